@@ -1,69 +1,170 @@
 # encoding=utf-8
 
 import os
-import threading
+import re
+import math
+import glob
+import json
 import shutil
 import hashlib
-from datetime import datetime
+from datetime import datetime, timezone
+import time
+import zipfile
 from local_settings import *
-from JsonExporterForIOS import build_split_archive, SEFARIA_EXPORT_PATH, get_export_path, updated_books_list, new_books_since_last_update, clear_old_bundles, SCHEMA_VERSION, PREV_SCHEMA_VERSION
-from flask import Flask, request, Response, jsonify
+from export_common import build_split_archive, get_export_path, get_bundle_path, LAST_UPDATED_PATH, PACK_PATH, SCHEMA_VERSION, PREV_SCHEMA_VERSION
+from bundle_jobs import BuildScheduler, BUILDING, DONE
+from bundle_cache import BundleCacheManager
+from bundle_manifest import ManifestCache, MANIFEST_FILE
+from file_cache import FileHashCache, JsonFileCache
+from bundle_shards import ShardIndexCache, link_shards, shard_part
+from export_catalog import CatalogCache
+from build_lease import BuildLease, is_leased, wait_for_lease
+from export_queue import ExportQueue, LONG_RUNNING_ACTIONS
+import metrics
+from prometheus_client import CONTENT_TYPE_LATEST
+from flask import Flask, request, Response, jsonify, stream_with_context, send_file, abort, g
+from werkzeug.security import safe_join
 from werkzeug.datastructures import FileStorage
 try:
     from local_settings import DEBUG_MODE
 except ImportError:
     DEBUG_MODE = False
+try:
+    from local_settings import BUNDLE_BUILD_WORKERS
+except ImportError:
+    BUNDLE_BUILD_WORKERS = 2
+try:
+    from local_settings import BUNDLE_CACHE_MAX_BYTES
+except ImportError:
+    BUNDLE_CACHE_MAX_BYTES = 10e9
+try:
+    from local_settings import BUNDLE_CACHE_SWEEP_INTERVAL
+except ImportError:
+    BUNDLE_CACHE_SWEEP_INTERVAL = 300
+try:
+    from local_settings import MANIFEST_RECHECK_INTERVAL
+except ImportError:
+    MANIFEST_RECHECK_INTERVAL = 30
+try:
+    from local_settings import BUNDLE_LEASE_TTL
+except ImportError:
+    BUNDLE_LEASE_TTL = 60
+try:
+    from local_settings import MAX_BUNDLE_WAIT
+except ImportError:
+    MAX_BUNDLE_WAIT = 30
 
 # schema version is now required when requesting an API view that is schema specific
 # in the case it's not provided, we will fall back to the last version that allowed it to not be defined (which is buggy behavior)
 DEFAULT_API_SCHEMA_VERSION = "6"
 app = Flask(__name__)
 URL_BASE = 'static/ios-export'
+MAX_BUNDLE_PARTS = 32
+MIN_BUNDLE_PART_SIZE = 1e6
+BUNDLE_ID_PATTERN = re.compile('[0-9a-f]{40}')  # see get_bundle_filename
+build_scheduler = BuildScheduler(BUNDLE_BUILD_WORKERS)
+manifest_cache = ManifestCache(MANIFEST_RECHECK_INTERVAL)
+shard_indexes = ShardIndexCache(MANIFEST_RECHECK_INTERVAL)
+file_hashes = FileHashCache()
+catalogs = CatalogCache(MANIFEST_RECHECK_INTERVAL)
+json_files = JsonFileCache(MANIFEST_RECHECK_INTERVAL)
+export_queue = ExportQueue()
+bundle_cache = BundleCacheManager([get_bundle_path(SCHEMA_VERSION), get_bundle_path(PREV_SCHEMA_VERSION)],
+                                  BUNDLE_CACHE_MAX_BYTES, BUNDLE_CACHE_SWEEP_INTERVAL, on_evict=manifest_cache.invalidate)
+
+
+@app.before_request
+def start_timer():
+    g.start_time = time.time()
+
+
+@app.after_request
+def record_latency(response):
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    metrics.REQUEST_LATENCY.labels(route, request.method, response.status_code).observe(time.time() - g.start_time)
+    return response
 
 
-def url_stubs(bundle_path, schema_version):
+def url_stubs(bundle_path, schema_version, manifest):
     bundle_name = os.path.basename(bundle_path)
-    try:
-        values = [f'{URL_BASE}/{schema_version}/bundles/{bundle_name}/{f}' for f in os.listdir(bundle_path)]
-    except FileNotFoundError:
-        values = []
-    values.sort()
-    return values
+    urls = []
+    for part in manifest['parts']:
+        # parts that live outside the bundle directory (shards) carry their path relative to the export directory
+        path = part.get('path') or f'bundles/{bundle_name}/{part["name"]}'
+        urls.append(f'{URL_BASE}/{schema_version}/{path}')
+    return urls
 
 
-def get_directory_size(dir_path):
-    total = 0
-    for f in os.listdir(dir_path):  # this is naive but works for the case at hand
-        total += os.path.getsize(os.path.join(dir_path, f))
-    return total
+def get_bundle_manifest(zip_path, shard_index):
+    """
+    :return: manifest of the bundle in `zip_path`, or None if there is no such bundle or it links to shards that
+    have been rebuilt since
+    """
+    manifest = manifest_cache.get(zip_path)
+    if manifest and manifest.get('shardIndex') and (shard_index is None or manifest['shardIndex'] != shard_index.id):
+        return None
+    return manifest
 
 
-def create_zip_bundle(book_list, zip_path, zip_dirname, file_locations):
-    # thread safety is critical in this method.
-    def is_recent_dir(dirname):  # this method should only return False if the directory in question exists and is "old"
-        try:
-            s = os.stat(dirname)
-        except FileNotFoundError:
-            return True
+def get_bundle_lock_path(zip_path):
+    return f'{os.path.dirname(zip_path)}/.{os.path.basename(zip_path)}.lock'
 
-        diff = datetime.now() - datetime.fromtimestamp(s.st_mtime)
-        return diff.total_seconds() < 120
 
+def is_bundle_built(zip_path, shard_index_id):
+    # reads the manifest from disk rather than the manifest cache, which may not have seen another worker's build yet
     try:
-        os.mkdir('./tmp')
-    except FileExistsError:
-        pass
-
-    tmp_dir = f'./tmp/{zip_dirname}'
-    if os.path.exists(tmp_dir):
-        if is_recent_dir(tmp_dir):
+        with open(os.path.join(zip_path, MANIFEST_FILE)) as fp:
+            manifest = json.load(fp)
+    except FileNotFoundError:
+        return False
+    return not manifest.get('shardIndex') or manifest['shardIndex'] == shard_index_id
+
+
+def create_zip_bundle(book_list, zip_path, zip_dirname, file_locations, shards=(), shard_index_id=None,
+                      num_parts=None, part_size=None):
+    """
+    Builds the bundle in `zip_path`. Only the process holding the bundle's lease builds it; a process that loses the
+    race waits for the holder and only builds itself if the holder died without publishing the bundle.
+    The bundle is built in a hidden directory next to `zip_path` and published with a rename, so readers never see a
+    partially written bundle.
+    """
+    os.makedirs(os.path.dirname(zip_path), exist_ok=True)  # the lock lives next to the bundle
+    lock_path = get_bundle_lock_path(zip_path)
+    lease = BuildLease(lock_path, BUNDLE_LEASE_TTL)
+    while not lease.acquire():
+        wait_for_lease(lock_path, BUNDLE_LEASE_TTL)
+        if is_bundle_built(zip_path, shard_index_id):
             return
 
-    build_split_archive(book_list, tmp_dir, file_locations)
-    try:
-        shutil.move(tmp_dir, zip_path)
-    except FileNotFoundError:  # can theoretically happen if another thread is active
-        return
+    with lease:
+        if is_bundle_built(zip_path, shard_index_id):  # published by the previous holder just before it released
+            return
+        bundle_root = os.path.dirname(zip_path)
+        if lease.took_over:  # leftovers of the crashed build
+            for path in glob.glob(f'{bundle_root}/.{zip_dirname}.*.tmp'):
+                shutil.rmtree(path, ignore_errors=True)
+        tmp_dir = f'{bundle_root}/.{zip_dirname}.{lease.token.rsplit(":", 1)[-1]}.tmp'
+        try:
+            filenames = build_split_archive(book_list, tmp_dir, file_locations, num_parts=num_parts, part_size=part_size)
+            bundle_size = sum(os.path.getsize(f'{tmp_dir}/{f}') for f in filenames)
+            metrics.BUNDLE_BYTES_WRITTEN.inc(bundle_size)
+            metrics.BUNDLE_SIZE_BYTES.observe(bundle_size)
+            if shards:
+                link_shards(tmp_dir, shards, shard_index_id)
+            if os.path.exists(zip_path):  # superseded bundle linking to old shards
+                old_dir = f'{tmp_dir}.old'
+                os.rename(zip_path, old_dir)
+                os.rename(tmp_dir, zip_path)
+                shutil.rmtree(old_dir, ignore_errors=True)
+            else:
+                os.rename(tmp_dir, zip_path)
+            manifest_cache.invalidate(zip_path)
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def get_bundle_job_id(schema_version, zip_dirname):
+    return f'{schema_version}/{zip_dirname}'
 
 
 def get_schema_from_request(req):
@@ -73,30 +174,299 @@ def get_schema_from_request(req):
         return DEFAULT_API_SCHEMA_VERSION
 
 
+def parse_number(value):
+    """
+    :return: `value`, a number or a numeric string, as a float
+    :raises ValueError: for booleans, NaN and infinity, and anything float() rejects with ValueError
+    """
+    if isinstance(value, bool):
+        raise ValueError(f'Not a number: {value}')
+    number = float(value)
+    if not math.isfinite(number):
+        raise ValueError(f'Not a finite number: {value}')
+    return number
+
+
+def get_part_options(req):
+    """
+    Optional balanced splitting requested by the client: `parts` equally sized parts, or parts of about `partSize`
+    bytes, so the parts can be downloaded in parallel.
+    :return: (num_parts, part_size), both None for the default splitting
+    """
+    num_parts, part_size = req.json.get('parts'), req.json.get('partSize')
+    num_parts = parse_number(num_parts) if num_parts is not None else None
+    part_size = parse_number(part_size) if part_size is not None else None
+    num_parts = min(max(int(num_parts), 1), MAX_BUNDLE_PARTS) if num_parts else None
+    part_size = max(int(part_size), MIN_BUNDLE_PART_SIZE) if part_size and not num_parts else None
+    return num_parts, part_size
+
+
+def get_wait_time(req):
+    """
+    :return: seconds the client is willing to wait for a bundle build to finish, capped at MAX_BUNDLE_WAIT
+    """
+    wait = req.args.get('wait') or req.json.get('wait')
+    return min(max(parse_number(wait), 0), MAX_BUNDLE_WAIT) if wait is not None else 0
+
+
 @app.route('/makeBundle', methods=['POST'])
 def make_bundle():
     if not request.json or not request.json.get('books'):
         return Response(status=400, response='Invalid JSON')
+    if not is_title_list(request.json['books']):
+        return Response(status=400, response='Invalid books')
 
     schema_version = get_schema_from_request(request)
     export_path = f'{SEFARIA_EXPORT_PATH}/{schema_version}'
 
-    book_list = [f'{b}.zip' for b in request.json['books']]
-    book_list = [b for b in book_list if os.path.exists(os.path.join(export_path, b))]
-    zip_dirname = get_bundle_filename(book_list)
+    try:
+        num_parts, part_size = get_part_options(request)
+    except (ValueError, TypeError):
+        return Response(status=400, response='Invalid parts or partSize')
+    try:
+        wait = get_wait_time(request)
+    except (ValueError, TypeError):
+        return Response(status=400, response='Invalid wait')
+
+    books = catalogs.get(export_path)
+    return serve_bundle(schema_version, [b for b in request.json['books'] if b in books], num_parts, part_size, wait)
+
+
+def serve_bundle(schema_version, titles, num_parts=None, part_size=None, wait=0):
+    """
+    Answers a bundle request for `titles` from the bundle cache or shards, or schedules the build of the bundle.
+    :param titles: exported titles to bundle
+    """
+    export_path = f'{SEFARIA_EXPORT_PATH}/{schema_version}'
+    book_list = [f'{t}.zip' for t in titles]
+    zip_dirname = get_bundle_filename(book_list, num_parts, part_size)
     zip_path = f'{export_path}/bundles/{zip_dirname}'
+    # an explicitly requested split is honoured exactly, so such bundles are not assembled from shards
+    shard_index = None if num_parts or part_size else shard_indexes.get(f'{export_path}/shards')
+
+    bundle_cache.start()
+    manifest = get_bundle_manifest(zip_path, shard_index)
+    if manifest:
+        bundle_cache.touch(zip_path)
+        metrics.BUNDLE_REQUESTS.labels('hit').inc()
+        return bundle_response(zip_path, schema_version, manifest)
+
+    shards, remainder = shard_index.cover(titles) if shard_index else ([], titles)
+    if shards and not remainder:
+        # answered entirely by pre-built shards, nothing to build
+        parts = [shard_part(s) for s in shards]
+        metrics.BUNDLE_REQUESTS.labels('shards').inc()
+        return bundle_response(zip_path, schema_version, {'size': sum(p['size'] for p in parts), 'parts': parts})
+
+    metrics.BUNDLE_REQUESTS.labels('miss').inc()
+    job_id = get_bundle_job_id(schema_version, zip_dirname)
+    job = build_scheduler.get(job_id)
+    lock_path = get_bundle_lock_path(zip_path)
+    if not (job and job.is_active()) and is_leased(lock_path, BUNDLE_LEASE_TTL):
+        # another worker is building this bundle
+        if wait and wait_for_lease(lock_path, BUNDLE_LEASE_TTL, timeout=wait):
+            manifest = get_bundle_manifest(zip_path, shard_index)
+            if manifest:
+                return bundle_response(zip_path, schema_version, manifest)
+        return jsonify({'id': zip_dirname, 'status': BUILDING}), 202
+    bundle_cache.request_sweep()  # eviction runs on the cache thread, not in this request
+    job = build_scheduler.submit(job_id,
+                                 create_zip_bundle, [f'{t}.zip' for t in remainder], zip_path, zip_dirname, export_path,
+                                 shards, shard_index.id if shard_index else None, num_parts, part_size)
+    if wait and job.wait(wait):
+        # the build finished while the client waited, answer in this round trip
+        manifest = get_bundle_manifest(zip_path, shard_index)
+        if manifest:
+            return bundle_response(zip_path, schema_version, manifest)
+    return jsonify({'id': zip_dirname, 'status': job.status}), 202
+
+
+def is_title_list(value):
+    return isinstance(value, list) and all(isinstance(title, str) for title in value)
+
+
+def parse_time_stamp(stamp):
+    """
+    :return: the ISO 8601 `stamp` as a naive datetime in UTC. Stamps without an offset are in the server's local time,
+    like the ones the exporter writes.
+    """
+    return datetime.fromisoformat(stamp).astimezone(timezone.utc).replace(tzinfo=None)
+
+
+@app.route('/deltaBundle', methods=['POST'])
+def delta_bundle():
+    """
+    Bundle of the books that changed since the client's export. Expects the `titles` of the client's
+    last_updated.json (title -> time stamp) and optionally the `books` the client has downloaded, to which the delta is
+    restricted. Accepts the same `parts`, `partSize` and `wait` options as /makeBundle. Clients with the same snapshot
+    get the same delta, which is built once and then served from the bundle cache.
+    """
+    if not request.json or not isinstance(request.json.get('titles'), dict):
+        return Response(status=400, response='Invalid JSON')
+    if request.json.get('books') and not is_title_list(request.json['books']):
+        return Response(status=400, response='Invalid books')
+    schema_version = get_schema_from_request(request)
+    export_path = f'{SEFARIA_EXPORT_PATH}/{schema_version}'
+    try:
+        num_parts, part_size = get_part_options(request)
+        wait = get_wait_time(request)
+        client_titles = {title: parse_time_stamp(stamp) for title, stamp in request.json['titles'].items()}
+    except (ValueError, TypeError, OverflowError):
+        return Response(status=400, response='Invalid JSON')
 
-    if os.path.exists(zip_path):
-        return {
-            'bundleArray': url_stubs(zip_path, schema_version),
-            'downloadSize': get_directory_size(zip_path),
-        }
-    else:
-        clear_old_bundles(SCHEMA_VERSION)
-        clear_old_bundles(PREV_SCHEMA_VERSION)
-        t = threading.Thread(target=create_zip_bundle, args=(book_list, zip_path, zip_dirname, export_path))
-        t.start()
-        return Response(status=202, response='Accepted')
+    last_updated = json_files.get(f'{export_path}{LAST_UPDATED_PATH}')
+    if last_updated is None:
+        return Response(status=404, response='No export for this schema version')
+    books = catalogs.get(export_path)
+    wanted = set(request.json['books']) if request.json.get('books') else None
+    titles = sorted(
+        title for title, stamp in last_updated['titles'].items()
+        if title in books and (wanted is None or title in wanted)
+        and (title not in client_titles or parse_time_stamp(stamp) > client_titles[title])
+    )
+    if not titles:
+        return {'books': [], 'bundleArray': [], 'downloadSize': 0, 'parts': []}
+    response = serve_bundle(schema_version, titles, num_parts, part_size, wait)
+    if isinstance(response, dict):
+        response['books'] = titles
+    return response
+
+
+def bundle_response(zip_path, schema_version, manifest):
+    urls = url_stubs(zip_path, schema_version, manifest)
+    return {
+        'bundleArray': urls,
+        'downloadSize': manifest['size'],
+        'parts': [{'url': url, 'size': part['size'], 'sha256': part['sha256']}
+                  for url, part in zip(urls, manifest['parts'])],
+    }
+
+
+@app.route('/bundleStatus', methods=['GET'])
+def bundle_status():
+    """
+    Cheap polling endpoint for bundles requested through /makeBundle. Reports the state of the build job
+    (queued, building, failed or done) and includes the bundle urls once the bundle is available.
+    """
+    zip_dirname = request.args.get('id')
+    if not zip_dirname or not BUNDLE_ID_PATTERN.fullmatch(zip_dirname):
+        return Response(status=400, response='Invalid bundle id')
+    schema_version = get_schema_from_request(request)
+    zip_path = f'{SEFARIA_EXPORT_PATH}/{schema_version}/bundles/{zip_dirname}'
+
+    manifest = get_bundle_manifest(zip_path, shard_indexes.get(f'{SEFARIA_EXPORT_PATH}/{schema_version}/shards'))
+    if manifest:
+        return {'id': zip_dirname, 'status': DONE, **bundle_response(zip_path, schema_version, manifest)}
+    job = build_scheduler.get(get_bundle_job_id(schema_version, zip_dirname))
+    if not (job and job.is_active()) and is_leased(get_bundle_lock_path(zip_path), BUNDLE_LEASE_TTL):
+        return {'id': zip_dirname, 'status': BUILDING, 'error': None}  # built by another worker
+    if job is None or job.status == DONE:  # never requested, or built and since removed from disk
+        return jsonify({'id': zip_dirname, 'status': 'unknown'}), 404
+    return {'id': zip_dirname, **job.serialize()}
+
+
+class ZipStreamBuffer:
+    """
+    Write-only file object that collects the bytes ZipFile writes so they can be handed to the client as they are
+    produced. ZipFile treats it as unseekable and writes data descriptors instead of seeking back to headers.
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data, self._chunks = b''.join(self._chunks), []
+        return data
+
+
+def iter_zip_stream(files, chunk_size=1 << 16):
+    """
+    Yields a ZIP_STORED archive of `files` piece by piece without writing anything to disk.
+    :param files: iterable of (path, arcname). Missing files are skipped.
+    """
+    buffer = ZipStreamBuffer()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_STORED) as z:
+        for path, arcname in files:
+            try:
+                fp = open(path, 'rb')
+            except FileNotFoundError:
+                continue
+            with fp:
+                info = zipfile.ZipInfo.from_file(path, arcname)
+                with z.open(info, 'w') as entry:
+                    for chunk in iter(lambda: fp.read(chunk_size), b''):
+                        entry.write(chunk)
+                        data = buffer.drain()
+                        if data:
+                            yield data
+    yield buffer.drain()
+
+
+@app.route('/streamBundle', methods=['POST'])
+def stream_bundle():
+    """
+    Takes the same book list as /makeBundle and streams a single zip of the book zips straight into the response,
+    so one-off selections need neither a build nor space under bundles/.
+    """
+    if not request.json or not request.json.get('books'):
+        return Response(status=400, response='Invalid JSON')
+    if not is_title_list(request.json['books']):
+        return Response(status=400, response='Invalid books')
+
+    schema_version = get_schema_from_request(request)
+    export_path = f'{SEFARIA_EXPORT_PATH}/{schema_version}'
+    books = catalogs.get(export_path)
+    book_list = [f'{b}.zip' for b in request.json['books'] if b in books]
+    files = [(os.path.join(export_path, b), b) for b in book_list]
+    return Response(stream_with_context(iter_zip_stream(files)), mimetype='application/zip',
+                    headers={'Content-Disposition': f'attachment; filename={get_bundle_filename(book_list)}.zip'})
+
+
+def get_content_hash(schema_version, filename, path):
+    """
+    sha256 of an export file. Bundle parts and shards take it from their manifest or the shard index, anything else
+    is hashed once and remembered until the file changes.
+    """
+    export_path = f'{SEFARIA_EXPORT_PATH}/{schema_version}'
+    parts = filename.split('/')
+    stat = os.stat(path)
+    if len(parts) == 3 and parts[0] == 'bundles':
+        # the cached manifest may predate a rebuild of the bundle, so only trust it while the part is unchanged
+        manifest = manifest_cache.get(f'{export_path}/bundles/{parts[1]}') or {'parts': []}
+        part = next((p for p in manifest['parts'] if p['name'] == parts[2] and 'path' not in p), None)
+        if part and part['sha256'] and (part['size'], part.get('mtime')) == (stat.st_size, stat.st_mtime):
+            return part['sha256']
+    elif len(parts) == 1 and filename.endswith('.zip'):
+        # the catalog may lag behind a running export, so only trust it while the zip is unchanged
+        entry = catalogs.get(export_path).get(filename[:-4])
+        if entry and entry['sha256'] and (entry['size'], entry['mtime']) == (stat.st_size, stat.st_mtime):
+            return entry['sha256']
+    elif len(parts) == 2 and parts[0] == 'shards':
+        shard_index = shard_indexes.get(f'{export_path}/shards')
+        shard = shard_index.shard_by_id.get(parts[1][:-4]) if shard_index else None
+        if shard:
+            return shard['sha256']
+    return file_hashes.get(path)
+
+
+@app.route(f'/{URL_BASE}/<schema_version>/<path:filename>')
+def export_file(schema_version, filename):
+    """
+    Local fallback for the files the CDN serves (book zips, bundles, shards, toc.json etc.).
+    Sends a strong ETag derived from the file's content hash, answers If-None-Match with 304 and serves byte ranges,
+    so unchanged files are not downloaded again and interrupted downloads can resume.
+    """
+    path = safe_join(SEFARIA_EXPORT_PATH, schema_version, filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    return send_file(path, conditional=True, etag=get_content_hash(schema_version, filename, path))
 
 
 @app.route('/packageData', methods=['GET'])
@@ -105,12 +475,25 @@ def get_package_paths():
         return jsonify([])
     package_name = request.args['package']
     schema_version = get_schema_from_request(request)
-    base_path = f'{SEFARIA_EXPORT_PATH}/{schema_version}/bundles'
-    return jsonify(url_stubs(f'{base_path}/{package_name}', schema_version))
-
-
-def get_bundle_filename(book_list: list) -> str:
-    books_hash = hashlib.sha1('|'.join(sorted(book_list)).encode('utf-8')).hexdigest()
+    export_path = f'{SEFARIA_EXPORT_PATH}/{schema_version}'
+    package_path = f'{export_path}/bundles/{package_name}'
+    # only names from packages.json, so the request can't point the manifest cache at other directories
+    packages = json_files.get(f'{export_path}{PACK_PATH}') or []
+    if package_name in {p['en'] for p in packages}:
+        manifest = manifest_cache.get(package_path) or {'size': 0, 'parts': []}
+    else:
+        manifest = {'size': 0, 'parts': []}
+    if request.args.get('manifest'):
+        # part sizes and checksums let clients verify and resume the download
+        return bundle_response(package_path, schema_version, manifest)
+    return jsonify(url_stubs(package_path, schema_version, manifest))
+
+
+def get_bundle_filename(book_list: list, num_parts=None, part_size=None) -> str:
+    key = '|'.join(sorted(book_list))
+    if num_parts or part_size:
+        key += f'|parts={num_parts}|partSize={part_size}'
+    books_hash = hashlib.sha1(key.encode('utf-8')).hexdigest()
     return f'{books_hash}'
 
 
@@ -131,7 +514,18 @@ def update():
     user_password = request.args.get('password')
     if user_password != password:
         return Response(status=403, response='Forbidden')
+    job_id = request.args.get('job')
+    if job_id:  # status of a job queued by an earlier call
+        status = export_queue.get_status(job_id)
+        if status is None:
+            return jsonify({'id': job_id, 'status': 'unknown'}), 404
+        return status
     action, index = request.args.get('action', default='export_updated'), request.args.get('index', default='')
+    if action in LONG_RUNNING_ACTIONS:
+        return Response(status=400, response=f'{action} runs until stopped and must be started as its own process')
+    if export_queue.is_worker_alive():
+        return export_queue.submit(action, index)
+    # no export worker running, fall back to a one-off exporter process
     os.system(f'python JsonExporterForIOS.py {action} {index} &')
     return {'status': 'ok'}
 
@@ -143,6 +537,8 @@ def books_export():
         return Response(status=403, response='Forbidden')
 
     if request.method == 'GET':
+        # the exporter boots Django and loads the Sefaria model, so it is only imported by the workers that need it
+        from JsonExporterForIOS import updated_books_list, new_books_since_last_update
         return jsonify(updated_books_list() + new_books_since_last_update())
     elif request.method == 'POST':
         f = request.args.get('filename')
@@ -150,6 +546,11 @@ def books_export():
         return Response(status=200, response='ok')
 
 
+@app.route('/metrics')
+def metrics_view():
+    return Response(metrics.generate(), mimetype=CONTENT_TYPE_LATEST)
+
+
 @app.route('/healthz')
 def healthcheck():
     return Response(status=200, response='Health: Ok')
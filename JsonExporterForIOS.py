@@ -1,5 +1,4 @@
 import sys
-from typing import Iterable
 import os
 try:
     import re2 as re
@@ -8,7 +7,6 @@ except ImportError:
 import json
 from tqdm import tqdm
 import zipfile
-import glob
 import time
 import traceback
 import requests
@@ -20,7 +18,51 @@ from datetime import timedelta
 from datetime import datetime
 import dateutil.parser
 from concurrent.futures.thread import ThreadPoolExecutor
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import multiprocessing
 from local_settings import *
+from export_common import *
+from file_cache import write_file_atomic
+from bundle_shards import build_shards
+from export_catalog import ExportCatalog
+from json_encoder import get_encoder
+
+try:
+    from local_settings import BUILD_PROCESSES
+except ImportError:
+    BUILD_PROCESSES = os.cpu_count()
+try:
+    from local_settings import PACKAGE_PARTS
+except ImportError:
+    PACKAGE_PARTS = {}  # package name -> number of equally sized parts to split the package bundle into
+try:
+    from local_settings import EXPORT_PROCESSES
+except ImportError:
+    EXPORT_PROCESSES = 1  # worker processes exporting texts in parallel; 1 exports in the main process
+try:
+    from local_settings import PARTIAL_EXPORTS
+except ImportError:
+    PARTIAL_EXPORTS = True  # export_updated exports again only the sections of a text that changed
+try:
+    from local_settings import EXPORT_WATERMARK_PATH
+except ImportError:
+    EXPORT_WATERMARK_PATH = './export_watermark.json'  # date up to which all history has been exported
+try:
+    from local_settings import EXPORT_WATCH_INTERVAL
+except ImportError:
+    EXPORT_WATCH_INTERVAL = 30  # seconds between reads of new history in export_watch
+try:
+    from local_settings import EXPORT_WATCH_DEBOUNCE
+except ImportError:
+    EXPORT_WATCH_DEBOUNCE = 120  # seconds without new edits after which export_watch exports a book
+try:
+    from local_settings import EXPORT_WATCH_MAX_DELAY
+except ImportError:
+    EXPORT_WATCH_MAX_DELAY = 900  # longest time in seconds a book that keeps being edited waits for its export
+try:
+    from local_settings import EXPORT_WATCH_BUNDLE_INTERVAL
+except ImportError:
+    EXPORT_WATCH_BUNDLE_INTERVAL = 3600  # shortest time in seconds between package bundle and shard rebuilds in export_watch
 
 sys.path.insert(0, SEFARIA_PROJECT_PATH)
 sys.path.insert(0, SEFARIA_PROJECT_PATH + "/sefaria")
@@ -51,20 +93,6 @@ or
 any section has a version different than the default version
 """
 
-PREV_SCHEMA_VERSION = "6"  # for clearing old bundles so space on disk doesn't run out
-SCHEMA_VERSION = "7"  # alternate versions offline
-
-TOC_PATH          = "/toc.json"
-SEARCH_TOC_PATH   = "/search_toc.json"
-TOPIC_TOC_PATH    = "/topic_toc.json"
-HEB_CATS_PATH     = "/hebrew_categories.json"
-PEOPLE_PATH       = "/people.json"
-PACK_PATH         = "/packages.json"
-CALENDAR_PATH     = "/calendar.json"
-LAST_UPDATED_PATH = "/last_updated.json"
-MAX_FILE_SIZE = 100e6
-BUNDLE_PATH = "/bundles"
-
 # TODO these descriptions should be moved to the DB
 # For now, this data also exists in Sefaria-Project/CalendarsPage.jsx
 # Engineers need to be careful to keep these two copies in sync if one of them is edited.
@@ -129,26 +157,16 @@ calendarDescriptions = {
 }
 
 
-def get_export_path(schema_version):
-    return f"{SEFARIA_EXPORT_PATH}/{schema_version}"
+# size, mtime and hash of every exported zip, shared by package sizing, last_updated.json and the download server
+export_catalog = ExportCatalog(get_export_path(SCHEMA_VERSION))
+doc_encoder = get_encoder(MINIFY_JSON)
 
 
-def get_last_updated_path(schema_version):
-    return get_export_path(schema_version) + LAST_UPDATED_PATH
-
-
-def get_bundle_path(schema_version):
-    return get_export_path(schema_version) + BUNDLE_PATH
-
-
-def keep_directory(func):
-    def new_func(*args, **kwargs):
-        original_dir = os.getcwd()
-        try:
-            return func(*args, **kwargs)
-        finally:
-            os.chdir(original_dir)
-    return new_func
+def dump_doc(doc):
+    """
+    :return: utf-8 bytes of `doc` serialized the way every exported json file is written
+    """
+    return doc_encoder.encode(doc)
 
 
 def write_doc(doc, path):
@@ -158,18 +176,65 @@ def write_doc(doc, path):
 
     if not os.path.exists(os.path.dirname(path)):
         os.makedirs(os.path.dirname(path))
-    with open(path, "w") as f:
-        json.dump(doc, f, ensure_ascii=False, indent=(None if MINIFY_JSON else 4), separators=((',',':') if MINIFY_JSON else None))
+    write_file_atomic(path, dump_doc(doc))
 
 
-@keep_directory
-def os_error_cleanup(schema_version):
-    os.chdir(get_export_path(schema_version))
-    json_files = glob.glob('*.json')
+class TextArchive:
+    """
+    The zip of one exported text. Documents are serialized straight into the zip, which is written to a temporary
+    file next to `zip_path` and renamed over it when the archive is closed, so readers never see a partial zip.
+    Used as a context manager, the zip is published when the block ends normally and discarded if it raises.
+    """
+
+    def __init__(self, zip_path):
+        self.zip_path = zip_path
+        self.tmp_path = f"{os.path.dirname(zip_path)}/.{os.path.basename(zip_path)}.{os.getpid()}.tmp"
+        os.makedirs(os.path.dirname(zip_path), exist_ok=True)
+        self._zip = zipfile.ZipFile(self.tmp_path, "w", zipfile.ZIP_DEFLATED)
+
+    @classmethod
+    def for_title(cls, title):
+        return cls(f"{get_export_path(SCHEMA_VERSION)}/{title}.zip")
+
+    def write_doc(self, doc, name):
+        """
+        :param name: file name of `doc` inside the zip
+        """
+        self._zip.writestr(name, dump_doc(doc))
+
+    def copy_from(self, zip_path, skip=lambda name: False):
+        """
+        Copies the files of the zip at `zip_path` into the archive, except those `skip` returns True for.
+        """
+        with zipfile.ZipFile(zip_path) as source:
+            for info in source.infolist():
+                if not skip(info.filename):
+                    self._zip.writestr(info, source.read(info))
+
+    def close(self):
+        self._zip.close()
+        os.replace(self.tmp_path, self.zip_path)
+
+    def discard(self):
+        self._zip.close()
+        try:
+            os.remove(self.tmp_path)
+        except FileNotFoundError:
+            pass
 
-    for jf in json_files:
-        if not re.search(r'(calendar|toc|last_updated|hebrew_categories).json', jf):
-            os.remove(jf)
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+
+def os_error_cleanup(schema_version):
+    # texts are written straight into their zips, which remove their temporary file when an export fails, so only
+    # the bundles need clearing to free space
     message = 'OSError during export'
     print(message)
     alert_slack(message, ':redlight:')
@@ -190,56 +255,76 @@ def alert_slack(message, icon_emoji):
         'icon_emoji': icon_emoji
     })
 
-@keep_directory
-def zip_last_text(title):
+def export_texts(skip_existing=False, processes=None):
     """
-    Zip up the JSON files of the last text exported into and delete the original JSON files.
-    Assumes that all previous JSON files have been deleted and the remaining ones should go in the new zip.
+    Exports all texts in the database.
+    TODO -- check history and last_updated to only export texts with changes
+    :param processes: number of worker processes exporting texts in parallel, EXPORT_PROCESSES by default
     """
-    export_path = get_export_path(SCHEMA_VERSION)
-    os.chdir(export_path)
-
-    zip_path = f"{export_path}/{title}.zip"
-
-    z = zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED)
+    processes = processes or EXPORT_PROCESSES
+    indexes = model.library.all_index_records()
+    to_export = [index for index in reversed(indexes)
+                 if not (skip_existing and os.path.isfile(f"{get_export_path(SCHEMA_VERSION)}/{index.title}.zip"))]
+    results = export_texts_in_parallel([i.title for i in to_export], processes) if processes > 1 \
+        else map(export_text_timed, to_export)
+
+    failed = set()
+    for title, success, seconds, entry in tqdm(results, desc='export all', total=len(to_export), file=sys.stdout):
+        if entry:
+            export_catalog.books[title] = entry
+        if not success:
+            failed.add(title)
+        tqdm.write(f"--- {title} - {round(seconds, 2)} seconds ---")
+    if failed:
+        print(f"Failed to export {len(failed)} texts: {', '.join(sorted(failed))}")
 
-    for file in glob.glob(f"./{title}*.json"):
-        z.write(file)
-        os.remove(file)
-    z.close()
+    write_last_updated([i.title for i in indexes if i.title not in failed])
 
 
-def export_texts(skip_existing=False):
+def export_text_timed(index):
     """
-    Exports all texts in the database.
-    TODO -- check history and last_updated to only export texts with changes
+    Exports `index` without touching the export catalog, which the caller updates from the returned entry. In a worker
+    process the catalog would otherwise be loaded, or even built by hashing every zip, once per process.
+    :return: (title, success, seconds, catalog entry of the text's zip)
     """
-    indexes = model.library.all_index_records()
-    for index in tqdm(reversed(indexes), desc='export all', total=len(indexes), file=sys.stdout):
-        if skip_existing and os.path.isfile(f"{get_export_path(SCHEMA_VERSION)}/{index.title}.zip"):
-            continue
+    start_time = time.time()
+    success = export_text(index, record_in_catalog=False)
+    title = index if isinstance(index, str) else index.title
+    return title, success, time.time() - start_time, ExportCatalog(get_export_path(SCHEMA_VERSION)).entry(title)
 
-        start_time = time.time()
-        success = export_text(index)
-        if not success:
-            indexes.remove(index)
-        tqdm.write(f"--- {index.title} - {round(time.time() - start_time, 2)} seconds ---")
 
-    write_last_updated([i.title for i in indexes])
+def export_texts_in_parallel(titles, processes):
+    """
+    Exports `titles` on a pool of `processes` worker processes, each exporting complete texts into their own zips.
+    Yields the results of export_text_timed as the texts finish.
+    """
+    # spawned rather than forked: the workers set up Django and their database connections themselves
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=processes, mp_context=context) as executor:
+        futures = [executor.submit(export_text_timed, title) for title in titles]
+        try:
+            for future in as_completed(futures):
+                yield future.result()
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
 
 
-@keep_directory
-def export_text(index, update=False):
+def export_text(index, update=False, record_in_catalog=True):
     """Writes a ZIP file containing text content json and text index JSON
     :param index: can be either Index or str
     :param update: True if you want to write_last_updated for just this index
+    :param record_in_catalog: update the zip's entry in the export catalog
     """
     if isinstance(index, str):
         index = model.library.get_index(index)
 
-    success = export_text_json(index)
-    success = export_index(index) and success
-    zip_last_text(index.title)
+    with TextArchive.for_title(index.title) as archive:
+        success = export_text_json(index, archive)
+        success = export_index(index, archive) and success
+    if record_in_catalog:
+        export_catalog.update([index.title])
 
     if update and success:
         write_last_updated([index.title], update=update)
@@ -259,8 +344,10 @@ def export_updated():
         export_all()
         return
 
+    newest_history_date = get_newest_history_date()
     print("Generating updated books list.")
-    updated_books = updated_books_list()
+    updated_history = updated_books_history()
+    updated_books = list(updated_history)
     print("{} books updated.".format(len(updated_books)))
     new_books = new_books_since_last_update()
     print("{} books added.".format(len(new_books)))
@@ -276,7 +363,7 @@ def export_updated():
 
     updated_books = [x.title for x in updated_indexes]
     for index in tqdm(updated_indexes, desc='export updated'):
-        success = export_text(index)
+        success = export_text_update(index, updated_history.get(index.title))
         if not success:
             updated_books.remove(index.title) # don't include books which dont export
 
@@ -287,6 +374,8 @@ def export_updated():
     export_calendar()
     export_authors()
     write_last_updated(updated_books, update=True)
+    if newest_history_date:
+        HistoryWatermark().save(newest_history_date)
 
 
 def updated_books_list():
@@ -294,59 +383,333 @@ def updated_books_list():
     Returns a list of books that have updated since the last export.
     Returns None is there is no previous last_updated.json
     """
+    updated_history = updated_books_history()
+    return None if updated_history is None else list(updated_history)
+
+
+def updated_books_history():
+    """
+    Scans history once, from the oldest timestamp in last_updated.json on, for the books that changed since their
+    last export.
+    :return: dict of title -> history entries that touched the book since its last export, or None if there is no
+    previous last_updated.json
+    """
     if not os.path.exists(get_last_updated_path(SCHEMA_VERSION)):
         return None
     last_updated = json.load(open(get_last_updated_path(SCHEMA_VERSION), "rb")).get("titles", {})
-    updated_books = [x[0] for x in [x for x in list(last_updated.items()) if has_updated(x[0], dateutil.parser.parse(x[1]))]]
-    return updated_books
+    last_updated = {title: dateutil.parser.parse(timestamp) for title, timestamp in last_updated.items()}
+    if not last_updated:
+        return {}
+    history = HistorySet({"date": {"$gt": min(last_updated.values())}}, proj=HISTORY_PROJECTION)
+    return find_updated_books(history, last_updated)
+
+
+# the fields of a history entry that tell which books it touched
+HISTORY_PROJECTION = {"date": 1, "ref": 1, "old.refs": 1, "new.refs": 1, "title": 1}
+
+
+class TitleLookup:
+    """
+    Finds the book a ref belongs to: the longest of `titles` that the ref starts with, followed by what
+    Ref(title).regex() accepts after a title: the end of the ref, ":", a space and a number, or ", " and a node title.
+    Replaces running every title's regex against every ref.
+    """
+
+    def __init__(self, titles):
+        self.titles = set(titles)
+
+    @staticmethod
+    def _is_title_end(tref, end):
+        separator, following = tref[end], tref[end + 1:end + 2]
+        return separator == ":" or (separator == " " and following.isdigit()) or (separator == "," and following == " ")
+
+    def get(self, tref):
+        if not isinstance(tref, str):
+            return None
+        if tref in self.titles:
+            return tref
+        for end in range(len(tref) - 1, 0, -1):
+            if tref[end] in " ,:" and self._is_title_end(tref, end) and tref[:end] in self.titles:
+                return tref[:end]
+        return None
+
+
+def get_history_refs(entry):
+    """
+    :return: refs touched by the history `entry`: its text ref and the refs of the link before and after the change
+    """
+    trefs = [entry.ref] if getattr(entry, "ref", None) else []
+    for link in (getattr(entry, "old", None), getattr(entry, "new", None)):
+        if isinstance(link, dict):
+            trefs += link.get("refs") or []
+    return trefs
+
+
+def find_updated_books(history, last_updated):
+    """
+    :param history: history entries, with at least the fields in HISTORY_PROJECTION
+    :param last_updated: dict of title -> datetime of the book's last export
+    :return: dict of title -> entries in `history` that touched the book after its last export
+    """
+    lookup = TitleLookup(last_updated)
+    updated = defaultdict(list)
+    for entry in history:
+        titles = {lookup.get(tref) for tref in get_history_refs(entry)}
+        titles.add(getattr(entry, "title", None))
+        for title in titles:
+            if title in last_updated and entry.date > last_updated[title]:
+                updated[title].append(entry)
+    return dict(updated)
+
+
+# seconds of history before the newest entry read that export_watch reads again, for entries another web server saved
+# with a slightly earlier date after that read
+WATERMARK_OVERLAP = 60
+
+
+class HistoryWatermark:
+    """
+    Date up to which every history entry has been exported, kept across runs in EXPORT_WATERMARK_PATH. Saved by
+    export_all, export_updated and export_watch. Books that fail to export aren't held back by it: their timestamps in
+    last_updated.json still make the next export_updated pick them up.
+    """
+
+    def __init__(self, path=EXPORT_WATERMARK_PATH):
+        self.path = os.path.abspath(path)
+
+    def load(self):
+        """
+        :return: datetime of the watermark, None if there is none for the current schema version
+        """
+        try:
+            with open(self.path) as fp:
+                doc = json.load(fp)
+        except (FileNotFoundError, ValueError):
+            return None
+        if doc.get("schema_version") != SCHEMA_VERSION:
+            return None
+        return dateutil.parser.parse(doc["date"])
+
+    def save(self, date):
+        write_doc({"schema_version": SCHEMA_VERSION, "date": date.isoformat()}, self.path)
+
+
+def get_newest_history_date():
+    newest = next(iter(HistorySet({}, sort=[("date", -1)], limit=1, proj={"date": 1})), None)
+    return newest.date if newest else None
+
+
+def export_watch():
+    """
+    Exports books continuously as they change. Reads the history entries after the watermark every
+    EXPORT_WATCH_INTERVAL seconds and exports a book, only its changed sections when possible, once it went
+    EXPORT_WATCH_DEBOUNCE seconds without new edits or waited EXPORT_WATCH_MAX_DELAY seconds. Catches up with
+    export_updated first if there is no watermark yet. Runs until interrupted.
+    """
+    watermark = HistoryWatermark()
+    if watermark.load() is None:
+        print("No history watermark, catching up with export_updated")
+        export_updated()
+    newest = watermark.load() or get_newest_history_date() or datetime.now()
+    lookup = TitleLookup(index.title for index in model.library.all_index_records())
+    pending = {}  # title -> {"history": entries, "first_seen": time, "last_seen": time}
+    seen = {}  # id -> date of the entries read within the overlap
+    last_bundle_build, bundles_stale = time.time(), False
+    while True:
+        now = time.time()
+        since = newest - timedelta(seconds=WATERMARK_OVERLAP)
+        for entry in HistorySet({"date": {"$gt": since}}, sort=[("date", 1)], proj=HISTORY_PROJECTION):
+            if entry._id in seen:
+                continue
+            seen[entry._id] = entry.date
+            newest = max(newest, entry.date)
+            index_title = getattr(entry, "title", None)
+            if index_title and index_title not in lookup.titles:
+                # a book added since the library was loaded
+                model.library.rebuild_toc()
+                lookup = TitleLookup(index.title for index in model.library.all_index_records())
+            titles = {lookup.get(tref) for tref in get_history_refs(entry)} | {index_title}
+            for title in titles & lookup.titles:
+                book = pending.setdefault(title, {"history": [], "first_seen": now})
+                book["history"].append(entry)
+                book["last_seen"] = now
+
+        settled = [title for title, book in pending.items() if now - book["last_seen"] >= EXPORT_WATCH_DEBOUNCE
+                   or now - book["first_seen"] >= EXPORT_WATCH_MAX_DELAY]
+        if settled:
+            failed = export_watched_books({title: pending.pop(title)["history"] for title in settled})
+            # failed books wait for the next pass, which also keeps the watermark before their edits
+            for title, history in failed.items():
+                pending[title] = {"history": history, "first_seen": now, "last_seen": now}
+            bundles_stale = True
+        # everything before the oldest edit still waiting for its export has been exported
+        oldest_pending = min((e.date for book in pending.values() for e in book["history"]), default=None)
+        watermark.save(oldest_pending - timedelta(milliseconds=1) if oldest_pending else newest)
+        seen = {entry_id: date for entry_id, date in seen.items() if date > newest - timedelta(seconds=WATERMARK_OVERLAP)}
+
+        if bundles_stale and time.time() - last_bundle_build >= EXPORT_WATCH_BUNDLE_INTERVAL:
+            rebuild_bundles()
+            last_bundle_build, bundles_stale = time.time(), False
+        time.sleep(EXPORT_WATCH_INTERVAL)
+
+
+def export_watched_books(history_by_title):
+    """
+    Exports the books in `history_by_title` and publishes them in last_updated.json and the export catalog. Package
+    bundles and shards are rebuilt separately, see EXPORT_WATCH_BUNDLE_INTERVAL; until then ad-hoc bundles built from
+    the old shards hold the previous export of these books.
+    :param history_by_title: dict of title -> history entries that touched the book
+    :return: dict of title -> history entries of the books that failed to export
+    """
+    exported, failed = [], {}
+    for title, history in history_by_title.items():
+        try:
+            index = model.library.get_index(title)
+        except BookNameError:
+            print("Skipping update for non-existent book '{}'".format(title))
+            continue
+        if export_text_update(index, history):
+            exported.append(title)
+        else:
+            print("Failed to export {}, will retry it".format(title))
+            failed[title] = history
+    print("Exported {}".format(", ".join(exported) or "nothing"))
+
+    if any(getattr(entry, "title", None) for history in history_by_title.values() for entry in history):
+        # index changes can move books in the toc and between packages
+        export_toc()
+        export_topic_toc()
+        export_hebrew_categories()
+        export_packages()
+    if exported:
+        write_last_updated(exported, update=True)
+    return failed
+
+
+def export_text_update(index, history=None):
+    """
+    Exports the changes to `index`. When history shows which sections changed, only the top sections holding them
+    are exported again and replaced in the text's zip. Otherwise the whole text is exported.
+    :param history: history entries that touched the text since its last export, None if it wasn't exported before
+    """
+    if PARTIAL_EXPORTS and history and os.path.isfile(f"{get_export_path(SCHEMA_VERSION)}/{index.title}.zip"):
+        section_refs = changed_sections(index, history)
+        if section_refs is not None:
+            return export_text_sections(index, section_refs)
+    return export_text(index)
 
 
-def has_updated(title, last_updated):
+def changed_sections(index, history):
+    """
+    Collects the sections of `index` touched by the `history` entries: the sections of edited text, the sections
+    holding this text's end of a changed link, and their neighbors, whose next and prev change when a section gains or
+    loses its text.
+    :return: list of section level Refs, or None if the text has to be exported completely because its index changed
+    or a change isn't limited to sections
+    """
+    sections = {}
+    for entry in history:
+        if getattr(entry, "title", None) == index.title:
+            return None
+        for tref in get_history_refs(entry):
+            section_refs = get_section_refs(tref, index)
+            if section_refs is None:
+                return None
+            sections.update((oref.normal(), oref) for oref in section_refs)
+
+    version_state = index.versionState()
+    for oref in list(sections.values()):
+        for neighbor in (oref.prev_section_ref(vstate=version_state), oref.next_section_ref(vstate=version_state)):
+            if neighbor:
+                sections.setdefault(neighbor.normal(), neighbor)
+    return list(sections.values())
+
+
+def get_section_refs(tref, index):
     """
-    title - str name of index
-    last_updated - datetime obj of our current knowledge of when this title was last updated
+    :return: the section level Refs `tref` covers in `index`, [] if it's in another text, None if it doesn't parse or
+    isn't limited to sections
     """
-    def construct_query(attribute, queries):
-        query_list = [{attribute: {'$regex': query}} for query in queries]
-        return {"date": {"$gt": last_updated}, '$or': query_list}
     try:
-        title_queries = model.Ref(title).regex(as_list=True)
+        oref = model.Ref(tref)
     except InputError:
-        return False
+        return None
+    if oref.index.title != index.title:
+        return []
+    if not (oref.is_section_level() or oref.is_segment_level()):
+        return None
+    return [r.section_ref() for r in oref.split_spanning_ref()]
 
-    text_count = HistorySet(construct_query("ref", title_queries)).count()
-    if text_count > 0:
-        return True
 
-    old_link_count = HistorySet(construct_query("old.refs", title_queries)).count()
-    if old_link_count > 0:
-        return True
+def get_top_section_key(oref):
+    """
+    :return: key shared by a top section ref (as in all_top_section_refs) and every ref inside it
+    """
+    node = oref.index_node
+    return tuple(node.address()), tuple(oref.sections[:1]) if getattr(node, "depth", 1) > 1 else ()
 
-    new_link_count = HistorySet(construct_query("new.refs", title_queries)).count()
-    if new_link_count > 0:
-        return True
 
-    index_count = HistorySet({"date": {"$gt": last_updated}, "title":title}).count()
-    if index_count > 0:
-        return True
+def get_file_ref(name):
+    """
+    :return: the ref of the top section file called `name` in a text's zip, None for other files
+    """
+    if name.endswith(".metadata.json"):
+        return name[:-len(".metadata.json")]
+    parts = name[:-len(".json")].rsplit(".", 2) if name.endswith(".json") else []
+    return parts[0] if len(parts) == 3 else None
+
 
-    return False
+def export_text_sections(index, section_refs):
+    """
+    Exports again the top sections of `index` holding `section_refs` and the text's index file, and replaces their
+    files in the text's zip. The other files of the zip are copied over unchanged.
+    """
+    keys = {get_top_section_key(oref) for oref in section_refs}
+    top_section_refs = [oref for oref in index.all_top_section_refs() if get_top_section_key(oref) in keys]
+    replaced_refs = {oref.normal() for oref in top_section_refs}
+    index_file_name = f"{index.title}_index.json"
+    zip_path = f"{get_export_path(SCHEMA_VERSION)}/{index.title}.zip"
+
+    archive = TextArchive(zip_path)
+    try:
+        archive.copy_from(zip_path, skip=lambda name: name == index_file_name or get_file_ref(name) in replaced_refs)
+        success = export_text_json(index, archive, top_section_refs)
+        success = export_index(index, archive) and success
+    except BaseException:
+        archive.discard()
+        raise
+    if not success:
+        # keep the zip as it was, the text is exported again on the next update
+        archive.discard()
+        return False
+    archive.close()
+    export_catalog.update([index.title])
+    return True
 
 
 def should_include_all_versions(index):
     return index.get_primary_corpus() == "Tanakh"
 
 
-def export_text_json(index):
+def export_text_json(index, archive=None, top_section_refs=None):
     """
     Takes a single document from the `texts` collection exports it, by chopping it up
     Add helpful data like
 
+    :param archive: TextArchive the json files are written into. By default the text's zip is written with just them.
+    :param top_section_refs: top sections to export, all of them by default
     returns True if export was successful
     """
+    if archive is None:
+        with TextArchive.for_title(index.title) as archive:
+            return export_text_json(index, archive, top_section_refs)
     try:
-        index_exporter = IndexExporter(index, include_all_versions=should_include_all_versions(index))
-        for oref in index.all_top_section_refs():
+        # links are prefetched per node for a complete export. A few sections are cheaper to query one by one.
+        index_exporter = IndexExporter(index, include_all_versions=should_include_all_versions(index),
+                                       prefetch_links=top_section_refs is None)
+        if top_section_refs is None:
+            top_section_refs = index.all_top_section_refs()
+        for oref in top_section_refs:
             if oref.is_section_level():
                 # depth 2 (or 1?)
                 text_by_version, metadata = index_exporter.section_data(oref)
@@ -378,9 +741,9 @@ def export_text_json(index):
                                 text_by_version[vtitle]["sections"][real_section.normal()] = text_array
 
             for (vtitle, lang), data in text_by_version.items():
-                path = make_path(vtitle, lang, metadata['ref'])
-                write_doc(data, path)
-            write_doc(metadata, f"{get_export_path(SCHEMA_VERSION)}/{metadata['ref']}.metadata.json")
+                archive.write_doc(data, make_file_name(vtitle, lang, metadata['ref']))
+            archive.write_doc(metadata, f"{metadata['ref']}.metadata.json")
+        index_exporter.release()
         return True
 
     except OSError as e:
@@ -403,8 +766,8 @@ def get_version_hash(version_title):
     return hashlib.md5(version_title.encode()).hexdigest()[:8]
 
 
-def make_path(version_title, lang, tref):
-    return f"{get_export_path(SCHEMA_VERSION)}/{tref}.{get_version_hash(version_title)}.{lang}.json"
+def make_file_name(version_title, lang, tref):
+    return f"{tref}.{get_version_hash(version_title)}.{lang}.json"
 
 
 def simple_link(link):
@@ -424,36 +787,206 @@ def simple_link(link):
 
 class SimpleTextChunk:
 
-    def __init__(self, oref: model.Ref, version: Version):
+    def __init__(self, oref: model.Ref, version: Version, node_ja: JaggedTextArray = None):
+        """
+        :param node_ja: `version`'s text of the whole node of `oref` (see get_node_ja). The section is sliced out of
+        it instead of being looked up in the version again.
+        """
         self.version = version
-        text_array = self.get_text_array_from_version(oref)
-        self.ja = JaggedTextArray(text_array)
+        if node_ja is None:
+            node_ja = self.get_node_ja(oref, version)
+        self.ja = JaggedTextArray(IndexExporter.get_text_array_from_ja(oref.sections, node_ja))
 
-    def get_text_array_from_version(self, oref: model.Ref):
-        text_array, _, _ = self.version.get_node_by_key_list(oref.index_node.version_address())
-        return IndexExporter.get_text_array_from_ja(oref.sections, JaggedTextArray(text_array))
+    @staticmethod
+    def get_node_ja(oref: model.Ref, version: Version) -> JaggedTextArray:
+        text_array, _, _ = version.get_node_by_key_list(oref.index_node.version_address())
+        return JaggedTextArray(text_array)
 
     def is_empty(self) -> bool:
         return self.ja.is_empty()
 
 
+class NodeLinks:
+    """
+    The links of one node of an index, fetched with a single query for the whole node and bucketed by the section of
+    their anchor, so that the sections of the node can be exported without a links query each.
+
+    A link between two refs of the node comes back from the node query only once, anchored at one side, while the
+    query of the other side's section would have returned it anchored there. Such sections are marked and their links
+    fetched per section, so every section gets exactly the links the per section query returns.
+    """
+
+    def __init__(self, node):
+        self.node = node
+        self._by_section = defaultdict(list)
+        self._per_section = set()  # section keys whose links have to be queried per section
+        self._all_per_section = False
+        self._node_title = node.full_title()
+        node_tref = node.ref().normal()
+        for link in get_links(node_tref, False):
+            anchor_oref = model.Ref(link["anchorRef"])
+            anchor_keys = self._section_keys(anchor_oref) if self._in_node(anchor_oref) else []
+            if link["ref"].startswith(node_tref):
+                other_oref = model.Ref(link["ref"])
+                if self._in_node(other_oref):
+                    self._query_per_section(self._section_keys(other_oref), exclude=anchor_keys)
+            if anchor_keys is None or len(anchor_keys) > 1:
+                # anchors spanning sections are rare and their handling depends on the section queried
+                self._query_per_section(anchor_keys)
+            elif anchor_keys:
+                self._by_section[anchor_keys[0]].append((link, anchor_oref))
+
+    def _in_node(self, oref):
+        return oref.index_node.full_title() == self._node_title
+
+    def _query_per_section(self, keys, exclude=()):
+        if keys is None:
+            self._all_per_section = True
+        else:
+            self._per_section.update(key for key in keys if key not in (exclude or ()))
+
+    @staticmethod
+    def _section_keys(oref):
+        """
+        :return: keys of the sections `oref` lies in (the `sections` of their section Refs), or None if unknown
+        """
+        try:
+            pieces = oref.split_spanning_ref() if oref.is_spanning() else [oref]
+        except Exception:
+            return None
+        return [tuple(p.sections[:-1]) if p.is_segment_level() else tuple(p.sections) for p in pieces]
+
+    @staticmethod
+    def fetch_section(oref):
+        return [(link, model.Ref(link["anchorRef"])) for link in get_links(oref.normal(), False)]
+
+    def get(self, oref):
+        """
+        :param oref: section level Ref in this node
+        :return: list of (link, Ref of its anchorRef), the same links get_links returns for `oref`
+        """
+        key = tuple(oref.sections)
+        if self._all_per_section or key in self._per_section:
+            return self.fetch_section(oref)
+        return self._by_section.get(key, [])
+
+
+class NodeVersions:
+    """
+    Emptiness index of the versions of one node: which versions have text in which section, in priority order.
+    The node's text of every version is loaded with one query per node and scanned in priority order. Only the text of
+    a version that is the default (first non-empty version of its language) of some section is kept; the others are
+    dropped right after the scan.
+    """
+
+    def __init__(self, node, versions, load_node_ja):
+        """
+        :param versions: versions of the index in priority order
+        :param load_node_ja: function returning the JaggedTextArray of a version's text of `node`
+        """
+        self.versions = versions
+        self.section_versions = defaultdict(list)  # section key -> positions of the versions with text there
+        self.jas = {}  # version position -> text of the node, for versions that are the default of some section
+        levels = max(getattr(node, 'depth', 1) - 1, 0)
+        covered = defaultdict(set)  # language -> sections that already have a default version
+        for i, version in enumerate(versions):
+            ja = load_node_ja(version)
+            keys = self._nonempty_section_keys(ja.array(), levels)
+            for key in keys:
+                self.section_versions[key].append(i)
+            if keys - covered[version.language]:
+                self.jas[i] = ja
+            covered[version.language] |= keys
+
+    @classmethod
+    def _nonempty_section_keys(cls, array, levels, prefix=()):
+        if levels == 0:
+            return {prefix} if not JaggedTextArray(array).is_empty() else set()
+        keys = set()
+        if isinstance(array, list):
+            for i, sub_array in enumerate(array):
+                keys |= cls._nonempty_section_keys(sub_array, levels - 1, prefix + (i + 1,))
+        return keys
+
+    def default_chunks(self, oref: model.Ref):
+        """
+        :return: (versions with text in `oref`, chunks of the default english and hebrew version of `oref`)
+        """
+        positions = self.section_versions.get(tuple(oref.sections), [])
+        chunks = []
+        for lang in ('en', 'he'):
+            i = next((i for i in positions if self.versions[i].language == lang), None)
+            if i is not None:
+                chunks.append(SimpleTextChunk(oref, self.versions[i], self.jas[i]))
+        return [self.versions[i] for i in positions], chunks
+
+
 class IndexExporter:
 
-    def __init__(self, index_obj: model.Index, include_all_versions=False):
+    def __init__(self, index_obj: model.Index, include_all_versions=False, prefetch_links=True):
+        """
+        :param prefetch_links: fetch the links of each node of the index with one query (see NodeLinks) instead of
+        querying the links of every section
+        """
         self.version_state = index_obj.versionState()
-        self.all_versions = VersionSet({"title": index_obj.title})
         self.include_all_versions = include_all_versions
+        # without all versions only the default version of each section is exported, so the versions' text is
+        # loaded per node when it is needed (see NodeVersions)
+        self.all_versions = VersionSet({"title": index_obj.title}, proj=None if include_all_versions else {"chapter": 0})
+        self.prefetch_links = prefetch_links
+        self._node_links = {}
+        # text of every version for the node currently being exported. Sections are sliced out of these, and they
+        # are dropped when the export moves on to the next node.
+        self._jas_node = None
+        self._node_jas = {}
+        self._node_versions = None
 
     @staticmethod
-    def get_default_chunk_by_lang(versions: Iterable, lang: str, oref: model.Ref):
+    def load_node_jas(oref: model.Ref, versions) -> dict:
+        """
+        Loads only the text of `oref`'s node from all `versions`, which were loaded without their text, with one query.
+        :return: dict of version _id -> JaggedTextArray of the node
+        """
+        keys = oref.index_node.version_address()
+        proj = {f"chapter.{'.'.join(keys)}": 1} if keys else {"chapter": 1}
+        node_versions = VersionSet({"_id": {"$in": [version._id for version in versions]}}, proj=proj)
+        return {version._id: SimpleTextChunk.get_node_ja(oref, version) for version in node_versions}
+
+    def get_default_chunks(self, oref: model.Ref):
+        """
+        :return: (versions with text in `oref`, chunks of the default english and hebrew version of `oref`)
+        """
+        if self._node_versions is None or oref.index_node is not self._jas_node:
+            self._jas_node = oref.index_node
+            versions = list(self.all_versions)
+            node_jas = self.load_node_jas(oref, versions)
+            self._node_versions = NodeVersions(oref.index_node, versions,
+                                               lambda version: node_jas.get(version._id, JaggedTextArray([])))
+        return self._node_versions.default_chunks(oref)
+
+    def get_chunks(self, oref: model.Ref):
+        """
+        :return: a SimpleTextChunk of `oref` for every version of the index, sliced from the versions' node texts
         """
-        Default is first version that matches `lang`
+        if oref.index_node is not self._jas_node:
+            self._jas_node = oref.index_node
+            self._node_jas = {}
+        chunks = []
+        for i, version in enumerate(self.all_versions):
+            node_ja = self._node_jas.get(i)
+            if node_ja is None:
+                node_ja = self._node_jas[i] = SimpleTextChunk.get_node_ja(oref, version)
+            chunks.append(SimpleTextChunk(oref, version, node_ja))
+        return chunks
+
+    def release(self):
         """
-        for v in versions:
-            if v.language == lang:
-                chunk = SimpleTextChunk(oref, v)
-                if not chunk.is_empty():
-                    return chunk
+        Drops the texts and links held for the index once it is exported.
+        """
+        self._jas_node = None
+        self._node_jas = {}
+        self._node_versions = None
+        self._node_links = {}
 
     @staticmethod
     def get_text_array_from_ja(sections, ja):
@@ -487,11 +1020,12 @@ class IndexExporter:
         return array
 
     @staticmethod
-    def _get_anchor_ref_dict(oref, section_length):
-        section_links = get_links(oref.normal(), False)
+    def _get_anchor_ref_dict(section_links, section_length):
+        """
+        :param section_links: list of (link, Ref of its anchorRef) as returned by NodeLinks.get
+        """
         anchor_ref_dict = defaultdict(list)
-        for link in section_links:
-            anchor_oref = model.Ref(link["anchorRef"])
+        for link, anchor_oref in section_links:
             if not anchor_oref.is_segment_level() or len(anchor_oref.sections) == 0:
                 continue  # don't bother with section level links
             start_seg_num = anchor_oref.sections[-1]
@@ -502,6 +1036,14 @@ class IndexExporter:
                 anchor_ref_dict[x] += [simple_link(link)]
         return anchor_ref_dict
 
+    def get_section_links(self, oref: model.Ref):
+        if not self.prefetch_links:
+            return NodeLinks.fetch_section(oref)
+        node_links = self._node_links.get(oref.index_node)
+        if node_links is None:
+            node_links = self._node_links[oref.index_node] = NodeLinks(oref.index_node)
+        return node_links.get(oref)
+
     @staticmethod
     def _get_base_file_name(tref, version_title):
         return f"{tref}.{get_version_hash(version_title)}.json"
@@ -515,12 +1057,11 @@ class IndexExporter:
         prev, next_ref = oref.prev_section_ref(vstate=self.version_state),\
                          oref.next_section_ref(vstate=self.version_state)
 
-        all_section_chunks = [c for c in [SimpleTextChunk(oref, v) for v in self.all_versions] if not c.is_empty()]
         if self.include_all_versions:
-            section_chunks = all_section_chunks
+            section_chunks = [c for c in self.get_chunks(oref) if not c.is_empty()]
+            section_versions = [c.version for c in section_chunks]
         else:
-            section_chunks = [self.get_default_chunk_by_lang([c.version for c in all_section_chunks], lang, oref) for lang in ('en', 'he')]
-            section_chunks = [c for c in section_chunks if c is not None]
+            section_versions, section_chunks = self.get_default_chunks(oref)
         jas = [c.ja for c in section_chunks]
         text_arrays = [
             self.strip_itags_recursive(ja.array()) for ja in jas
@@ -533,11 +1074,11 @@ class IndexExporter:
             "sectionRef": oref.normal(),
             "next": next_ref.normal() if next_ref else None,
             "prev": prev.normal() if prev else None,
-            "versions": self.serialize_all_version_details([c.version for c in all_section_chunks])
+            "versions": self.serialize_all_version_details(section_versions)
         }
 
         section_length = max([len(a) for a in text_arrays], default=0)
-        anchor_ref_dict = self._get_anchor_ref_dict(oref, section_length)
+        anchor_ref_dict = self._get_anchor_ref_dict(self.get_section_links(oref), section_length)
         offset = oref._get_offset([sec-1 for sec in oref.sections])
         text_serialized_list = [[] for _ in text_arrays]
         links_serialized = []
@@ -572,15 +1113,15 @@ class IndexExporter:
         return version.versionTitle, version.language
 
 
-def export_index(index):
+def export_index(index, archive):
     """
     Writes the JSON of the index record of the text called `title`.
+    :param archive: TextArchive of the text
     """
     try:
         serialized_index = index.contents_with_content_counts()
         annotate_versions_on_index(index.title, serialized_index)
-        path = f"{get_export_path(SCHEMA_VERSION)}/{index.title}_index.json"
-        write_doc(serialized_index, path)
+        archive.write_doc(serialized_index, f"{index.title}_index.json")
 
         return True
     except OSError:
@@ -627,7 +1168,7 @@ def get_indexes_in_category(cats, toc):
 
 
 def get_downloadable_packages():
-    export_path = get_export_path(SCHEMA_VERSION)
+    books = export_catalog.books
     toc = clean_toc_nodes(model.library.get_toc())
     packages = [
         {
@@ -705,10 +1246,7 @@ def get_downloadable_packages():
                 indexes += get_indexes_in_category([], toc)
             except InputError:
                 alert_slack(f"Error in `get_downloadable_packages()`. Full library", ':redlight:')
-        size = 0
-        for i in indexes:
-            curr_zip_path = f"{export_path}/{i}.zip"
-            size += os.path.getsize(curr_zip_path) if os.path.isfile(curr_zip_path) else 0  # get size in kb. overestimate by 1kb
+        size = sum(books[i]['size'] for i in indexes if i in books)
         if hasCats:
             # only include indexes if not complete library
             p["indexes"] = indexes
@@ -722,13 +1260,14 @@ def write_last_updated(titles, update=False):
     Writes to `last_updated.json` the current time stamp for all `titles`.
     :param update: True if you only want to update the file and not overwrite
     """
-    export_path = get_export_path(SCHEMA_VERSION)
-    def get_timestamp(title):
-        return datetime.fromtimestamp(os.stat(f'{export_path}/{title}.zip').st_mtime).isoformat()
+    if titles:
+        export_catalog.update(titles)
+    else:
+        titles = export_catalog.scan().titles()
+    export_catalog.save()  # also tells the download server to reload the catalog
 
-    if not titles:
-        titles = filter(lambda x: x.endswith('zip'), os.listdir(export_path))
-        titles = [re.search(r'([^/]+)\.zip$', title).group(1) for title in titles]
+    def get_timestamp(title):
+        return datetime.fromtimestamp(export_catalog.books[title]['mtime']).isoformat()
 
     last_updated = {
         "schema_version": SCHEMA_VERSION,
@@ -771,82 +1310,55 @@ def split_list(l, size):
     return values
 
 
-def build_split_archive(book_list, build_loc, export_dir='', archive_size=MAX_FILE_SIZE):
-    if os.path.exists(build_loc):
-        try:
-            rmtree(build_loc)
-        except NotADirectoryError:
-            os.remove(build_loc)
-    os.mkdir(build_loc)
-    z, current_size, i, filenames = None, 0, 0, []
-    for title in book_list:
-        if not z:
-            i += 1
-            filename = f'{build_loc}/{i}.zip'
-            z = zipfile.ZipFile(filename, 'w', zipfile.ZIP_DEFLATED)
-            current_size = 0
-            filenames.append(filename)
-        try:
-            z.write(os.path.join(export_dir, title), arcname=title)
-        except FileNotFoundError:
-            print(f"No zip file for {title}; the bundles will be missing this text")
-            continue
-        current_size += z.getinfo(title).compress_size
-        if current_size > archive_size:
-            z.close()
-            z = None
-    if z:
-        z.close()
-
-    return [os.path.basename(f) for f in filenames]
-
-
-@keep_directory
-def clear_old_bundles(schema_version, max_files=50):
-    """
-    This method will check the bundles directory and clean out old bundles (this would be updates that aren't being used)
-    :param old_age: bundles not served in this number of days will be deleted
-    :param max_files: if less than this many files exist, nothing will happen
-    :return:
-    """
-    os.chdir(get_bundle_path(schema_version))
-    # get packages
-    with open('../packages.json') as fp:
-        packages = json.load(fp)
-    packages = set(p['en'] for p in packages)
-    # list all non package bundles
-    bundles = [s for s in os.listdir('.') if s not in packages]
-    if len(bundles) < max_files:
-        return
-    # for each package if old, delete
-    for bundle in bundles:
-        try:
-            rmtree(bundle)
-        except FileNotFoundError:
-            pass
-
+def zip_packages(schema_version, compression=zipfile.ZIP_STORED, executor=None):
+    """
+    Builds the bundle of every package. All packages are built at once and their parts are written on a process pool.
+    :param executor: ProcessPoolExecutor to share with other builds. A pool of BUILD_PROCESSES is used if not given.
+    """
+    if executor is None:
+        with ProcessPoolExecutor(max_workers=BUILD_PROCESSES) as executor:
+            return zip_packages(schema_version, compression, executor)
 
-@keep_directory
-def zip_packages(schema_version):
     packages = get_downloadable_packages()
     bundle_path = get_bundle_path(schema_version)
     if not os.path.isdir(bundle_path):
         os.mkdir(bundle_path)
+    export_path = get_export_path(schema_version)
 
-    curdir = os.getcwd()
-    os.chdir(get_export_path(schema_version))
-
-    for package in packages:
+    def build_package(package):
         package_name = package['en']
-        print(package_name)
         if package_name == 'COMPLETE LIBRARY':
             titles = [i.title for i in model.library.all_index_records()]
         else:
             titles = package['indexes']
         titles = [f'{t}.zip' for t in titles]
-        build_split_archive(titles, f'{bundle_path}/{package_name}')
+        # built next to the published bundle and swapped in, so the server never serves a partially built package
+        package_dir = f'{bundle_path}/{package_name}'
+        tmp_dir = f'{bundle_path}/.{package_name}.{os.getpid()}.tmp'
+        build_split_archive(titles, tmp_dir, export_path, compression=compression, executor=executor,
+                            num_parts=PACKAGE_PARTS.get(package_name), part_size=MAX_FILE_SIZE)
+        if os.path.exists(package_dir):
+            os.rename(package_dir, f'{tmp_dir}.old')
+            os.rename(tmp_dir, package_dir)
+            rmtree(f'{tmp_dir}.old', ignore_errors=True)
+        else:
+            os.rename(tmp_dir, package_dir)
+        print(package_name)
+
+    # threads only wait on the process pool, so every package's parts are queued right away
+    with ThreadPoolExecutor(max_workers=len(packages) or 1) as package_executor:
+        list(package_executor.map(build_package, packages))
 
-    os.chdir(curdir)
+
+def zip_shards(schema_version):
+    """
+    Builds the content-addressed shards that the download server assembles ad-hoc bundles from.
+    Relies on packages.json, so run after export_packages.
+    """
+    packages = read_packages(schema_version)
+    catalog = export_catalog if schema_version == SCHEMA_VERSION else ExportCatalog(get_export_path(schema_version))
+    catalog.scan().save()
+    build_shards(get_export_path(schema_version), get_shard_path(schema_version), packages, SHARD_SIZE, catalog.books)
 
 
 def export_hebrew_categories(for_sources=False):
@@ -1115,6 +1627,7 @@ def export_all(skip_existing=False):
     If `skip_existing`, skip any text that already has a zip file, otherwise delete everything and start fresh.
     """
     start_time = time.time()
+    newest_history_date = get_newest_history_date()
     export_toc()
     export_topic_toc()
     export_calendar()
@@ -1122,6 +1635,8 @@ def export_all(skip_existing=False):
     export_texts(skip_existing)
     export_authors()
     export_packages()
+    if newest_history_date:
+        HistoryWatermark().save(newest_history_date)
     print(("--- %s seconds ---" % round(time.time() - start_time, 2)))
 
 
@@ -1138,37 +1653,24 @@ def export_base_files_to_sources():
     export_packages(for_sources=True)  # relies on full dump to be available to measure file sizes
 
 
-@keep_directory
-def clear_bundles(schema_version):
-    curdir = os.getcwd()
-    try:
-        os.chdir(get_bundle_path(schema_version))
-    except FileNotFoundError:
-        return
-    for f in os.listdir('.'):
-        if os.path.isfile(f):
-            os.remove(f)
-        else:
-            rmtree(f)
-    os.chdir(curdir)
-
+def rebuild_bundles():
+    """
+    Rebuilds the package bundles and shards of both schema versions from the current export. Ad-hoc bundles are left
+    to the download server: bundles assembled from shards are rebuilt once the shard index changes, and all of them
+    are evicted by its cache sweep. Clearing them here would also break the builds the server has in progress.
+    """
+    with ProcessPoolExecutor(max_workers=BUILD_PROCESSES) as executor:
+        for schema_version in (SCHEMA_VERSION, PREV_SCHEMA_VERSION):
+            zip_packages(schema_version, executor=executor)
+            zip_shards(schema_version)
 
-if __name__ == '__main__':
-    purged = False
 
-    def purge():
-        global purged
-        if purged:
-            return
-        else:
-            purged = True
-            for schema_version in (SCHEMA_VERSION, PREV_SCHEMA_VERSION):
-                clear_bundles(schema_version)
-                zip_packages(schema_version)
-    # we've been experiencing many issues with strange books appearing in the toc. i believe this line should solve that
-    model.library.rebuild_toc()
-    action = sys.argv[1] if len(sys.argv) > 1 else None
-    index_title = sys.argv[2] if len(sys.argv) > 2 else None
+def run_action(action, index_title=None):
+    """
+    Runs one export action of the command line interface, followed by rebuilding the bundles and alerting slack.
+    Assumes the library's toc is current.
+    """
+    bundles_rebuilt = False
     if action == "export_all":
         export_all()
     elif action == "export_all_skip_existing":
@@ -1180,9 +1682,12 @@ if __name__ == '__main__':
             export_text(index_title, update=True)
     elif action == "export_updated":
         export_updated()
+    elif action == "export_watch":
+        export_watch()
     elif action == "purge_cloudflare":  # purge general toc and last_updated files
         if USE_CLOUDFLARE:
-            purge()
+            rebuild_bundles()
+            bundles_rebuilt = True
             purge_cloudflare_cache([])
         else:
             print("not using cloudflare")
@@ -1203,13 +1708,16 @@ if __name__ == '__main__':
         export_packages()
     elif action == "write_last_updated":  # for updating package infor
         write_last_updated([], True)
-    purge()
-    try:
-        url = os.environ['SLACK_URL']
-    except KeyError:
+    if not bundles_rebuilt:
+        rebuild_bundles()
+    if 'SLACK_URL' not in os.environ:
         print('slack url not configured')
-        sys.exit(0)
+        return
     timestamp = datetime.fromtimestamp(os.stat(f'{get_export_path(SCHEMA_VERSION)}/last_updated.json').st_mtime).ctime()
     alert_slack(f'Mobile export complete. Timestamp on `last_updated.json` is {timestamp}', ':file_folder')
 
 
+if __name__ == '__main__':
+    # we've been experiencing many issues with strange books appearing in the toc. i believe this line should solve that
+    model.library.rebuild_toc()
+    run_action(sys.argv[1] if len(sys.argv) > 1 else None, sys.argv[2] if len(sys.argv) > 2 else None)
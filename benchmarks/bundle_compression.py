@@ -0,0 +1,51 @@
+"""
+Compares building the COMPLETE LIBRARY package with ZIP_DEFLATED (the old behavior) and ZIP_STORED.
+
+Run from the repository root on a machine with a full export:
+    python benchmarks/bundle_compression.py [schema_version] [repeat]
+"""
+import os
+import sys
+import time
+import zipfile
+import tempfile
+from shutil import rmtree
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import JsonExporterForIOS as jefi
+
+
+def run(titles, export_dir, compression, repeat):
+    timings, size, parts = [], 0, 0
+    for _ in range(repeat):
+        build_loc = tempfile.mkdtemp(prefix='bundle-bench-')
+        try:
+            start = time.perf_counter()
+            filenames = jefi.build_split_archive(titles, f'{build_loc}/COMPLETE LIBRARY', export_dir, compression=compression)
+            timings.append(time.perf_counter() - start)
+            parts = len(filenames)
+            size = sum(os.path.getsize(f'{build_loc}/COMPLETE LIBRARY/{f}') for f in filenames)
+        finally:
+            rmtree(build_loc)
+    return min(timings), sum(timings) / len(timings), size, parts
+
+
+def main():
+    schema_version = sys.argv[1] if len(sys.argv) > 1 else jefi.SCHEMA_VERSION
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    export_dir = jefi.get_export_path(schema_version)
+    titles = [f'{i.title}.zip' for i in jefi.model.library.all_index_records()]
+    print(f'COMPLETE LIBRARY: {len(titles)} titles from {export_dir}, best/mean of {repeat} runs')
+
+    results = {}
+    for name, compression in (('ZIP_DEFLATED', zipfile.ZIP_DEFLATED), ('ZIP_STORED', zipfile.ZIP_STORED)):
+        best, mean, size, parts = run(titles, export_dir, compression, repeat)
+        results[name] = (best, size)
+        print(f'{name:>12}: best {best:8.2f}s  mean {mean:8.2f}s  {size / 1e6:10.1f} MB in {parts} parts')
+
+    (deflated_time, deflated_size), (stored_time, stored_size) = results['ZIP_DEFLATED'], results['ZIP_STORED']
+    print(f'ZIP_STORED is {deflated_time / stored_time:.1f}x faster and {(stored_size - deflated_size) / deflated_size:+.2%} in size')
+
+
+if __name__ == '__main__':
+    main()
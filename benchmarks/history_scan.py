@@ -0,0 +1,101 @@
+"""
+Compares finding the books changed since their last export with regex count queries per title (the old has_updated,
+up to four queries per title) against one scan of history mapped to titles by TitleLookup (find_updated_books).
+
+The history is synthetic: text edits, link changes and index edits spread over library titles (most of them on a
+few popular books) and dates, held in memory. A regex query is emulated by scanning the entries, so the old
+approach's time grows with titles x entries the way an unindexed regex query over history does. Both approaches must
+report the same changed books.
+
+Run from the repository root on a machine with the Sefaria library:
+    python benchmarks/history_scan.py [number of titles] [number of history entries]
+"""
+import os
+import re
+import sys
+import time
+import random
+from types import SimpleNamespace
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import JsonExporterForIOS as jefi
+
+
+def synthetic_history(titles, count, start, seed=0):
+    rng = random.Random(seed)
+    # edits concentrate on a few popular books, like on the site
+    weights = [1 / (rank + 1) for rank in range(len(titles))]
+
+    def random_title():
+        return rng.choices(titles, weights)[0]
+
+    def random_ref():
+        return f'{random_title()} {rng.randint(1, 50)}:{rng.randint(1, 30)}'
+
+    entries = []
+    for _ in range(count):
+        date = start + timedelta(seconds=rng.randint(0, 30 * 86400))
+        kind = rng.random()
+        if kind < 0.6:
+            entries.append(SimpleNamespace(date=date, ref=random_ref()))
+        elif kind < 0.98:
+            refs = [random_ref(), random_ref()]
+            entries.append(SimpleNamespace(date=date, old={'refs': refs}, new={'refs': refs}))
+        else:
+            entries.append(SimpleNamespace(date=date, title=random_title()))
+    return entries
+
+
+def count(entries, attribute, patterns, since):
+    # one regex count query: {"date": {"$gt": since}, "$or": [{attribute: {"$regex": pattern}} ...]}
+    total = 0
+    for entry in entries:
+        if entry.date <= since:
+            continue
+        if attribute == 'ref':
+            values = [getattr(entry, 'ref', None)]
+        else:
+            values = (getattr(entry, attribute, None) or {}).get('refs', [])
+        if any(isinstance(v, str) and p.search(v) for v in values for p in patterns):
+            total += 1
+    return total
+
+
+def per_title_queries(entries, last_updated):
+    queries = 0
+    updated = set()
+    for title, since in last_updated.items():
+        patterns = [re.compile(p) for p in jefi.model.Ref(title).regex(as_list=True)]
+        for attribute in ('ref', 'old', 'new'):
+            queries += 1
+            if count(entries, attribute, patterns, since):
+                updated.add(title)
+                break
+        else:
+            queries += 1
+            if any(getattr(e, 'title', None) == title and e.date > since for e in entries):
+                updated.add(title)
+    return updated, queries
+
+
+if __name__ == '__main__':
+    num_titles = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    num_entries = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+    rng = random.Random(1)
+    titles = rng.sample([index.title for index in jefi.model.library.all_index_records()], num_titles)
+    start = datetime(2024, 1, 1)
+    history = synthetic_history(titles, num_entries, start)
+    last_updated = {title: start + timedelta(seconds=rng.randint(0, 30 * 86400)) for title in titles}
+
+    before = time.perf_counter()
+    old, queries = per_title_queries(history, last_updated)
+    old_seconds = time.perf_counter() - before
+    before = time.perf_counter()
+    new = set(jefi.find_updated_books(history, last_updated))
+    new_seconds = time.perf_counter() - before
+
+    print(f'{num_titles} titles, {num_entries} history entries, {len(new)} books changed')
+    print(f'per title regex queries: {queries:>6} queries  {old_seconds:8.3f}s')
+    print(f'single history scan:     {1:>6} query    {new_seconds:8.3f}s')
+    print(f'same books: {old == new}')
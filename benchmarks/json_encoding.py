@@ -0,0 +1,81 @@
+"""
+Compares the json encoders of json_encoder.py on section documents, for both MINIFY_JSON settings. Reports the
+time to encode all documents with each encoder and checks that every encoder's output is byte-identical to json's.
+
+The documents are read from exported text zips when given, otherwise generated to resemble exported sections:
+text arrays in hebrew and english with html tags, and metadata with links and version details.
+
+Run from the repository root:
+    python benchmarks/json_encoding.py [path/to/Title.zip ...]
+"""
+import os
+import sys
+import json
+import time
+import random
+import zipfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import json_encoder
+
+HEBREW_WORDS = ['בְּרֵאשִׁית', 'בָּרָא', 'אֱלֹהִים', 'אֵת', 'הַשָּׁמַיִם', 'וְאֵת', 'הָאָרֶץ', '<b>רש"י</b>', 'וְהָאָרֶץ']
+ENGLISH_WORDS = ['When', 'God', 'began', 'to', 'create', 'heaven', 'and', 'earth', '<i>the</i>', '<sup>1</sup>']
+
+
+def sentence(words, rng):
+    return ' '.join(rng.choice(words) for _ in range(rng.randint(8, 60)))
+
+
+def synthetic_documents(count=2000, seed=0):
+    rng = random.Random(seed)
+    docs = []
+    for i in range(count):
+        ref = f'Genesis {i + 1}'
+        segments = rng.randint(5, 40)
+        docs.append({'ref': ref, 'text': [sentence(HEBREW_WORDS, rng) for _ in range(segments)]})
+        docs.append({'ref': ref, 'text': [sentence(ENGLISH_WORDS, rng) for _ in range(segments)]})
+        docs.append({
+            'ref': ref,
+            'heRef': 'בראשית א',
+            'links': [[{'sourceRef': f'Rashi on {ref}:{s + 1}:{k + 1}', 'sourceHeRef': 'רש"י על בראשית',
+                        'category': 'Commentary'} for k in range(rng.randint(0, 6))] for s in range(segments)],
+            'versions': [{'versionTitle': 'The Koren Jerusalem Bible', 'language': 'en', 'priority': 1.5,
+                          'versionNotes': sentence(ENGLISH_WORDS, rng)}],
+            'next': f'Genesis {i + 2}', 'prev': f'Genesis {i}' if i else None,
+        })
+    return docs
+
+
+def zip_documents(paths):
+    docs = []
+    for path in paths:
+        with zipfile.ZipFile(path) as z:
+            docs += [json.loads(z.read(name)) for name in z.namelist() if name.endswith('.json')]
+    return docs
+
+
+def measure(encoder, docs, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        encoded = [encoder.encode(doc) for doc in docs]
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, encoded
+
+
+if __name__ == '__main__':
+    docs = zip_documents(sys.argv[1:]) if len(sys.argv) > 1 else synthetic_documents()
+    names = ['json'] + (['orjson'] if json_encoder.orjson else [])
+    print(f'{len(docs)} documents' + ('' if json_encoder.orjson else ' (orjson is not installed)'))
+    for minify in (False, True):
+        reference_seconds, reference = None, None
+        for name in names:
+            for verify in ((False, True) if name != 'json' else (False,)):
+                encoder = json_encoder.get_encoder(minify, name, verify=verify)
+                seconds, encoded = measure(encoder, docs)
+                if reference is None:
+                    reference_seconds, reference = seconds, encoded
+                    mb = sum(len(e) for e in reference) / 1e6
+                print(f'minify={minify!s:<5} {encoder.name:<20} {seconds:7.3f}s  {mb / seconds:7.1f} MB/s  '
+                      f'{reference_seconds / seconds:5.2f}x  identical: {encoded == reference}')
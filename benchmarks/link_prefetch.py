@@ -0,0 +1,62 @@
+"""
+Compares fetching the links of every section of a book with one get_links query per section (the old behavior)
+against one query per node (NodeLinks). Reports the number of get_links queries and the wall time per book, and checks
+that both produce the same links for every section.
+
+Run from the repository root on a machine with the Sefaria database:
+    python benchmarks/link_prefetch.py [title ...]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import JsonExporterForIOS as jefi
+
+DEFAULT_TITLES = ['Genesis', 'Berakhot', 'Rashi on Genesis', 'Mishneh Torah, Prayer and the Priestly Blessing']
+
+
+def section_refs(index):
+    # the same walk over sections as export_text_json
+    def walk(oref):
+        if oref.is_section_level():
+            yield oref
+        else:
+            for sub in oref.all_subrefs():
+                yield from walk(sub)
+    for top in index.all_top_section_refs():
+        yield from walk(top)
+
+
+def run(index, prefetch_links):
+    queries = 0
+    get_links = jefi.get_links
+
+    def counting_get_links(*args, **kwargs):
+        nonlocal queries
+        queries += 1
+        return get_links(*args, **kwargs)
+
+    jefi.get_links = counting_get_links
+    try:
+        start = time.perf_counter()
+        exporter = jefi.IndexExporter(index, prefetch_links=prefetch_links)
+        links = {}
+        for oref in section_refs(index):
+            section_links = exporter.get_section_links(oref)
+            anchor_ref_dict = exporter._get_anchor_ref_dict(section_links, section_length=10000)
+            links[oref.normal()] = dict(anchor_ref_dict)
+        return time.perf_counter() - start, queries, links
+    finally:
+        jefi.get_links = get_links
+
+
+if __name__ == '__main__':
+    titles = sys.argv[1:] or DEFAULT_TITLES
+    print(f'{"title":<50} {"queries":>15} {"seconds":>17}  same links')
+    for title in titles:
+        index = jefi.model.library.get_index(title)
+        before_seconds, before_queries, before = run(index, prefetch_links=False)
+        after_seconds, after_queries, after = run(index, prefetch_links=True)
+        print(f'{title:<50} {before_queries:>7} -> {after_queries:<6} {before_seconds:>7.2f} -> {after_seconds:<7.2f}  '
+              f'{before == after}')
@@ -0,0 +1,50 @@
+"""
+Measures what a gunicorn worker pays at boot: the time to import the download server and the resident memory of the
+process afterwards. The exporter (which boots Django and the Sefaria model) is measured alongside for comparison;
+the server must stay well below it.
+
+Run from the repository root with the server's local_settings.py in place:
+    python benchmarks/server_startup.py [repeat]
+"""
+import os
+import sys
+import json
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROBE = '''
+import json, resource, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{
+    'seconds': elapsed,
+    'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    'django': 'django' in sys.modules,
+}}))
+'''
+
+
+def measure(module, repeat):
+    runs = []
+    for _ in range(repeat):
+        # a fresh interpreter per run, like a freshly forked worker that hasn't imported anything yet
+        result = subprocess.run([sys.executable, '-c', PROBE.format(module=module)], cwd=ROOT,
+                                capture_output=True, text=True)
+        if result.returncode != 0:
+            return None, result.stderr.strip().splitlines()[-1]
+        runs.append(json.loads(result.stdout.strip().splitlines()[-1]))
+    return runs, None
+
+
+if __name__ == '__main__':
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    for module in ('DownloadServer', 'JsonExporterForIOS'):
+        runs, error = measure(module, repeat)
+        if runs is None:
+            print(f'{module:<20} failed to import: {error}')
+            continue
+        seconds = sorted(r['seconds'] for r in runs)
+        rss = max(r['max_rss_mb'] for r in runs)
+        print(f'{module:<20} import min {seconds[0]:.3f}s  median {seconds[len(seconds) // 2]:.3f}s  '
+              f'max RSS {rss:.1f} MB  django loaded: {runs[0]["django"]}')
@@ -0,0 +1,135 @@
+# encoding=utf-8
+"""
+Filesystem lease locks that let the gunicorn workers agree on which process builds a bundle.
+
+A lease is a lock file created with O_CREAT | O_EXCL, so exactly one process can hold it. The holder refreshes the
+file's mtime from a heartbeat thread while it works. A lease whose mtime is older than `ttl` belongs to a crashed or
+stuck process and is taken over: the stale lock file is first renamed out of the way, which only one contender can do,
+and then created again.
+"""
+
+import os
+import time
+import uuid
+import socket
+import threading
+
+
+class BuildLease:
+
+    def __init__(self, lock_path, ttl=60, heartbeat_interval=None):
+        """
+        :param lock_path: lock file shared by every process that might build the same thing
+        :param ttl: seconds without a heartbeat after which the lease is considered abandoned
+        :param heartbeat_interval: seconds between heartbeats, a third of `ttl` by default
+        """
+        self.lock_path = lock_path
+        self.ttl = ttl
+        self.heartbeat_interval = heartbeat_interval or ttl / 3
+        self.token = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex}'
+        self.took_over = False
+        self._stop = threading.Event()
+        self._heartbeat = None
+
+    def acquire(self):
+        """
+        :return: True if this lease now holds the lock
+        """
+        for _ in range(2):
+            try:
+                fd = os.open(self.lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+            except FileExistsError:
+                if not self._break_stale():
+                    return False
+                continue
+            with os.fdopen(fd, 'w') as fp:
+                fp.write(self.token)
+            self._stop.clear()
+            self._heartbeat = threading.Thread(target=self._beat, daemon=True, name='lease-heartbeat')
+            self._heartbeat.start()
+            return True
+        return False
+
+    def _break_stale(self):
+        """
+        Moves the lock file aside if it is stale.
+        :return: True if the lock file was stale and has been removed
+        """
+        try:
+            stat = os.stat(self.lock_path)
+        except FileNotFoundError:
+            return True
+        if time.time() - stat.st_mtime < self.ttl:
+            return False
+        stale_path = f'{self.lock_path}.{uuid.uuid4().hex}.stale'
+        try:
+            os.rename(self.lock_path, stale_path)
+        except FileNotFoundError:  # another process got there first
+            return True
+        if os.stat(stale_path).st_ino != stat.st_ino:
+            # another process took the lease over between our stat and rename. Put its fresh lock file back.
+            try:
+                os.link(stale_path, self.lock_path)
+            except FileExistsError:
+                pass
+            os.remove(stale_path)
+            return False
+        os.remove(stale_path)
+        self.took_over = True
+        return True
+
+    def is_held(self):
+        """
+        :return: True if the lock file still belongs to this lease
+        """
+        try:
+            with open(self.lock_path) as fp:
+                return fp.read() == self.token
+        except FileNotFoundError:
+            return False
+
+    def _beat(self):
+        while not self._stop.wait(self.heartbeat_interval):
+            if not self.is_held():
+                break
+            try:
+                os.utime(self.lock_path)
+            except FileNotFoundError:
+                break
+
+    def release(self):
+        self._stop.set()
+        if self._heartbeat:
+            self._heartbeat.join()
+            self._heartbeat = None
+        if self.is_held():
+            os.remove(self.lock_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+def is_leased(lock_path, ttl=60):
+    """
+    :return: True if some process currently holds a live lease on `lock_path`
+    """
+    try:
+        return time.time() - os.stat(lock_path).st_mtime < ttl
+    except FileNotFoundError:
+        return False
+
+
+def wait_for_lease(lock_path, ttl=60, timeout=None, poll_interval=0.5):
+    """
+    Blocks until nobody holds a live lease on `lock_path`, i.e. the holder finished or its lease went stale.
+    :return: False if `timeout` seconds passed first
+    """
+    deadline = None if timeout is None else time.time() + timeout
+    while is_leased(lock_path, ttl):
+        if deadline is not None and time.time() >= deadline:
+            return False
+        time.sleep(poll_interval)
+    return True
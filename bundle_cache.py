@@ -0,0 +1,134 @@
+# encoding=utf-8
+"""
+Least-recently-used eviction of ad-hoc bundles for the download server.
+
+Accesses are written to disk as the bundle directory's mtime, at most once a minute per bundle and worker, so every
+gunicorn worker sees the same access history. A background thread periodically (or when asked to) removes the least
+recently used bundles until the total size of all ad-hoc bundles fits in the configured byte budget. Package bundles
+(the ones listed in packages.json) are never evicted.
+"""
+
+import os
+import json
+import time
+import threading
+import traceback
+from shutil import rmtree
+from metrics import BUNDLE_EVICTIONS, BUNDLE_EVICTED_BYTES, BUNDLE_SWEEP_SECONDS
+
+
+def get_directory_size(dir_path):
+    total = 0
+    for f in os.listdir(dir_path):  # this is naive but works for the case at hand
+        total += os.path.getsize(os.path.join(dir_path, f))
+    return total
+
+
+def get_package_names(bundle_root):
+    try:
+        with open(os.path.join(bundle_root, '../packages.json')) as fp:
+            return set(p['en'] for p in json.load(fp))
+    except FileNotFoundError:
+        return set()
+
+
+class BundleCacheManager:
+
+    def __init__(self, bundle_roots, max_bytes, sweep_interval=300, on_evict=None, touch_interval=60):
+        """
+        :param bundle_roots: list of `bundles` directories (one per schema version) sharing the byte budget
+        :param max_bytes: total size ad-hoc bundles may take on disk
+        :param sweep_interval: seconds between background sweeps when no sweep was requested
+        :param on_evict: optional callable invoked with the path of every evicted bundle
+        :param touch_interval: seconds during which further accesses to a bundle aren't written to disk again
+        """
+        self.bundle_roots = bundle_roots
+        self.max_bytes = max_bytes
+        self.sweep_interval = sweep_interval
+        self.on_evict = on_evict
+        self.touch_interval = touch_interval
+        self._accessed = {}  # bundle path -> time of the last access written to disk
+        self._sizes = {}  # (path, inode) -> size; a republished bundle is renamed into place under a new inode
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def touch(self, bundle_path):
+        now = time.time()
+        with self._lock:
+            if now - self._accessed.get(bundle_path, 0) < self.touch_interval:
+                return
+            self._accessed[bundle_path] = now
+        try:
+            os.utime(bundle_path, (now, now))
+        except FileNotFoundError:
+            pass
+
+    def request_sweep(self):
+        self._wakeup.set()
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='bundle-cache', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.sweep_interval)
+            self._wakeup.clear()
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f'Bundle cache sweep failed: {e}')
+                print(traceback.format_exc())
+
+    def _list_bundles(self):
+        """
+        :return: list of (last access time, size, path) for every ad-hoc bundle
+        """
+        bundles, sizes = [], {}
+        for root in self.bundle_roots:
+            packages = get_package_names(root)
+            try:
+                entries = list(os.scandir(root))
+            except FileNotFoundError:
+                continue
+            for entry in entries:
+                if entry.name in packages or entry.name.startswith('.') or not entry.is_dir():  # hidden: build in progress
+                    continue
+                try:
+                    stat = entry.stat()
+                    key = (entry.path, stat.st_ino)
+                    sizes[key] = self._sizes.get(key) or get_directory_size(entry.path)
+                except FileNotFoundError:  # evicted by another worker
+                    continue
+                bundles.append((stat.st_mtime, sizes[key], entry.path))
+        self._sizes = sizes
+        return bundles
+
+    def sweep(self):
+        """
+        Evicts least recently used bundles until the ad-hoc bundles fit in `max_bytes`.
+        :return: list of evicted bundle paths
+        """
+        start = time.time()
+        with self._lock:
+            self._accessed = {path: atime for path, atime in self._accessed.items()
+                              if start - atime < self.touch_interval}
+        bundles = self._list_bundles()
+        total = sum(size for _, size, _ in bundles)
+        evicted = []
+        for _, size, path in sorted(bundles):
+            if total <= self.max_bytes:
+                break
+            rmtree(path, ignore_errors=True)
+            if self.on_evict:
+                self.on_evict(path)
+            total -= size
+            evicted.append(path)
+            BUNDLE_EVICTIONS.inc()
+            BUNDLE_EVICTED_BYTES.inc(size)
+        BUNDLE_SWEEP_SECONDS.observe(time.time() - start)
+        return evicted
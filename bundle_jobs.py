@@ -0,0 +1,105 @@
+# encoding=utf-8
+"""
+In-process scheduling of bundle builds for the download server.
+
+Every bundle is identified by a job id (schema version + bundle hash). Requests for a bundle that is already
+queued or building attach to the existing job instead of starting a new build, and the number of concurrent
+builds is bounded by the size of the worker pool.
+"""
+
+import time
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from metrics import BUNDLE_JOBS, BUNDLE_BUILD_SECONDS, BUNDLE_BUILD_FAILURES
+
+QUEUED = 'queued'
+BUILDING = 'building'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class BundleJob:
+
+    def __init__(self, job_id):
+        self.id = job_id
+        self.status = QUEUED
+        self.error = None
+        self.submitted = time.time()
+        self.finished = None
+        self._finished_event = threading.Event()
+
+    def is_active(self):
+        return self.status in (QUEUED, BUILDING)
+
+    def wait(self, timeout=None):
+        """
+        Blocks until the job is done or failed.
+        :return: False if `timeout` seconds passed first
+        """
+        return self._finished_event.wait(timeout)
+
+    def serialize(self):
+        return {'status': self.status, 'error': self.error}
+
+
+class BuildScheduler:
+
+    def __init__(self, max_workers, keep_finished=600):
+        """
+        :param max_workers: maximum number of bundles being built at the same time
+        :param keep_finished: seconds a finished job is remembered so its status can still be polled
+        """
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='bundle-build')
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self.keep_finished = keep_finished
+
+    def submit(self, job_id, fn, *args):
+        """
+        Schedules `fn(*args)` under `job_id` unless a job with that id is already queued or building.
+        :return: the BundleJob that will produce the bundle
+        """
+        with self._lock:
+            self._prune()
+            job = self._jobs.get(job_id)
+            if job and job.is_active():
+                return job
+            job = BundleJob(job_id)
+            self._jobs[job_id] = job
+            BUNDLE_JOBS.labels(QUEUED).inc()
+        self._executor.submit(self._run, job, fn, args)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _run(self, job, fn, args):
+        job.status = BUILDING
+        BUNDLE_JOBS.labels(QUEUED).dec()
+        BUNDLE_JOBS.labels(BUILDING).inc()
+        start = time.time()
+        try:
+            fn(*args)
+        except Exception as e:
+            print(f'Bundle build {job.id} failed: {e}')
+            print(traceback.format_exc())
+            BUNDLE_BUILD_FAILURES.inc()
+            job.error = str(e)
+            job.status = FAILED
+        else:
+            job.status = DONE
+        finally:
+            job.finished = time.time()
+            BUNDLE_BUILD_SECONDS.observe(job.finished - start)
+            BUNDLE_JOBS.labels(BUILDING).dec()
+            job._finished_event.set()
+
+    def _prune(self):
+        # must be called while holding self._lock
+        now = time.time()
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.finished and now - job.finished > self.keep_finished]
+        for job_id in expired:
+            del self._jobs[job_id]
@@ -0,0 +1,64 @@
+# encoding=utf-8
+"""
+Every bundle directory holds a manifest listing its parts with their sizes, mtimes and checksums. The manifests are
+written when the bundle is built and kept in memory by the server, so serving a known bundle reads no files.
+"""
+
+import os
+import json
+from file_cache import FileCache, file_sha256, write_json_atomic
+
+MANIFEST_FILE = 'manifest.json'
+
+
+def write_manifest(bundle_dir, filenames, hashes=None):
+    """
+    Writes the manifest of the bundle in `bundle_dir`.
+    :param filenames: names of the parts of the bundle, relative to `bundle_dir`
+    :param hashes: optional dict of filename -> sha256 for parts whose hash is already known
+    """
+    hashes = hashes or {}
+    parts = []
+    for name in sorted(filenames):
+        path = os.path.join(bundle_dir, name)
+        stat = os.stat(path)
+        parts.append({'name': name, 'size': stat.st_size, 'mtime': stat.st_mtime,
+                      'sha256': hashes.get(name) or file_sha256(path)})
+    manifest = {'size': sum(p['size'] for p in parts), 'parts': parts}
+    write_json_atomic(os.path.join(bundle_dir, MANIFEST_FILE), manifest)
+    return manifest
+
+
+def manifest_from_listing(bundle_dir):
+    """
+    Manifest for bundles built before manifests existed. These have no checksums.
+    """
+    parts = [{'name': f, 'size': os.path.getsize(os.path.join(bundle_dir, f)), 'sha256': None}
+             for f in sorted(os.listdir(bundle_dir)) if f != MANIFEST_FILE]
+    return {'size': sum(p['size'] for p in parts), 'parts': parts}
+
+class ManifestCache(FileCache):
+    """
+    In-memory cache of bundle manifests, by bundle directory. A cached manifest is served for `recheck_interval` seconds
+    after checking only that its bundle directory still exists, since another worker may have evicted it. After that
+    the manifest's mtime is checked and the manifest reloaded if it changed.
+    """
+
+    def __init__(self, recheck_interval=30, max_entries=1024):
+        super().__init__(recheck_interval, max_entries)
+
+    def file_path(self, bundle_dir):
+        return os.path.join(bundle_dir, MANIFEST_FILE)
+
+    def load(self, bundle_dir):
+        with open(self.file_path(bundle_dir)) as fp:
+            return json.load(fp)
+
+    def load_missing(self, bundle_dir):
+        try:
+            return manifest_from_listing(bundle_dir)
+        except FileNotFoundError:  # no such bundle
+            return None
+
+    def is_current(self, bundle_dir):
+        return os.path.isdir(bundle_dir)
@@ -0,0 +1,165 @@
+# encoding=utf-8
+"""
+Pre-built, content-addressed shards of book zips that ad-hoc bundles are assembled from.
+
+Books are grouped by the set of packages (from packages.json) that contain them, so every package is an exact union
+of groups. Each group is cut into shards of roughly `shard_size` bytes at content-defined boundaries: whether a shard
+ends after a book depends mostly on that book's title and size, with a cap of 2 * `shard_size` per shard. Adding or
+re-exporting one book can move a boundary, so it changes the shard holding it and may shift the boundaries of the
+shards that follow until the cut points line up again. Shards further away stay stable. A shard's id is derived from the titles and content hashes of its books, so the same shard url
+always serves the same bytes and can be cached indefinitely by the CDN.
+
+A bundle request is answered with every shard that lies completely inside the requested books plus a small remainder
+archive for the rest.
+"""
+
+import os
+import json
+import time
+import hashlib
+import zipfile
+from collections import defaultdict
+from file_cache import FileCache, file_sha256, write_json_atomic
+from bundle_manifest import MANIFEST_FILE
+
+SHARD_INDEX_FILE = 'index.json'
+
+
+def _ends_shard(title, size, shard_size):
+    # ends a shard with probability size / shard_size, so shards average `shard_size` bytes
+    title_hash = int(hashlib.sha1(title.encode('utf-8')).hexdigest()[:8], 16)
+    return title_hash < (size / shard_size) * 0xffffffff
+
+
+def plan_shards(titles, sizes, packages, shard_size):
+    """
+    :param titles: titles of every exported book
+    :param sizes: dict of title -> size of the book's zip
+    :param packages: contents of packages.json
+    :return: list of shards, each a list of titles
+    """
+    membership = defaultdict(set)
+    for package in packages:
+        for title in package.get('indexes', []):
+            membership[title].add(package['en'])
+    groups = defaultdict(list)
+    for title in titles:
+        groups[tuple(sorted(membership[title]))].append(title)
+
+    shards = []
+    for key in sorted(groups):
+        shard, current_size = [], 0
+        for title in sorted(groups[key]):
+            shard.append(title)
+            current_size += sizes[title]
+            if _ends_shard(title, sizes[title], shard_size) or current_size >= 2 * shard_size:
+                shards.append(shard)
+                shard, current_size = [], 0
+        if shard:
+            shards.append(shard)
+    return shards
+
+
+def get_shard_id(titles, hashes):
+    key = '|'.join(f'{title}:{hashes[title]}' for title in titles)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def build_shards(export_dir, shard_dir, packages, shard_size, books, retention=86400):
+    """
+    Builds the shards for all book zips in `export_dir` that don't exist yet and writes the shard index. Shards that
+    are already in the index keep their recorded size and sha256, so only new shards are hashed.
+    Shard files that are no longer in the index are removed once they are older than `retention` seconds, so clients
+    holding a recent answer can still download them.
+    :param books: export catalog of `export_dir` (title -> size and sha256 of its zip)
+    """
+    os.makedirs(shard_dir, exist_ok=True)
+    titles = list(books.keys())
+    sizes = {t: books[t]['size'] for t in titles}
+    hashes = {t: books[t]['sha256'] for t in titles}
+    try:
+        with open(f'{shard_dir}/{SHARD_INDEX_FILE}') as fp:
+            known = {shard['id']: shard for shard in json.load(fp)['shards']}
+    except FileNotFoundError:
+        known = {}
+
+    shards = []
+    for shard_titles in plan_shards(titles, sizes, packages, shard_size):
+        shard_id = get_shard_id(shard_titles, hashes)
+        shard_path = f'{shard_dir}/{shard_id}.zip'
+        if shard_id in known and os.path.exists(shard_path):
+            shards.append(known[shard_id])
+            continue
+        if not os.path.exists(shard_path):
+            tmp_path = f'{shard_dir}/.{shard_id}.zip.tmp'
+            with zipfile.ZipFile(tmp_path, 'w', zipfile.ZIP_STORED) as z:
+                for title in shard_titles:
+                    z.write(f'{export_dir}/{title}.zip', arcname=f'{title}.zip')
+            os.replace(tmp_path, shard_path)
+        shards.append({
+            'id': shard_id,
+            'books': shard_titles,
+            'size': os.path.getsize(shard_path),
+            'sha256': file_sha256(shard_path),
+        })
+
+    index = {'id': hashlib.sha1('|'.join(s['id'] for s in shards).encode('utf-8')).hexdigest(), 'shards': shards}
+    write_json_atomic(f'{shard_dir}/{SHARD_INDEX_FILE}', index)
+
+    current = {f'{s["id"]}.zip' for s in shards} | {SHARD_INDEX_FILE}
+    for f in os.listdir(shard_dir):
+        path = f'{shard_dir}/{f}'
+        if f not in current and time.time() - os.path.getmtime(path) > retention:
+            os.remove(path)
+    return index
+
+
+def shard_part(shard):
+    return {'name': f'{shard["id"]}.zip', 'path': f'shards/{shard["id"]}.zip', 'size': shard['size'], 'sha256': shard['sha256']}
+
+
+def link_shards(bundle_dir, shards, index_id):
+    """
+    Adds `shards` to the manifest of the remainder bundle in `bundle_dir`, so the bundle directory describes the
+    complete answer for its book list.
+    """
+    manifest_path = os.path.join(bundle_dir, MANIFEST_FILE)
+    with open(manifest_path) as fp:
+        manifest = json.load(fp)
+    shard_parts = [shard_part(s) for s in shards]
+    manifest['parts'] = shard_parts + manifest['parts']
+    manifest['size'] += sum(p['size'] for p in shard_parts)
+    manifest['shardIndex'] = index_id
+    write_json_atomic(manifest_path, manifest)
+
+
+class ShardIndex:
+
+    def __init__(self, index):
+        self.id = index['id']
+        self.shards = index['shards']
+        self.shard_by_id = {shard['id']: shard for shard in self.shards}
+        self._shard_by_title = {title: shard for shard in self.shards for title in shard['books']}
+
+    def cover(self, titles):
+        """
+        :return: (shards that lie completely inside `titles`, titles not covered by those shards)
+        """
+        titles = set(titles)
+        candidates = {self._shard_by_title[t]['id']: self._shard_by_title[t] for t in titles if t in self._shard_by_title}
+        shards = [s for s in candidates.values() if titles.issuperset(s['books'])]
+        covered = {title for s in shards for title in s['books']}
+        return shards, sorted(titles - covered)
+
+
+class ShardIndexCache(FileCache):
+    """
+    Keeps the shard index of each schema version in memory, by shard directory, reloading it when its mtime changes.
+    """
+
+    def file_path(self, shard_dir):
+        return os.path.join(shard_dir, SHARD_INDEX_FILE)
+
+    def load(self, shard_dir):
+        with open(self.file_path(shard_dir)) as fp:
+            return ShardIndex(json.load(fp))
@@ -0,0 +1,123 @@
+# encoding=utf-8
+"""
+Catalog of the exported book zips of one schema version: title -> size, mtime and sha256 of `<title>.zip`.
+
+The exporter keeps the catalog up to date as it writes zips and saves it to `catalog.json` in the export directory
+at the end of a run. The saved file doubles as the change marker for the download server, which keeps the catalog in
+memory and reloads it when the file's mtime changes, instead of stat-ing book zips on every request.
+"""
+
+import os
+import json
+from file_cache import FileCache, file_sha256, write_json_atomic
+
+CATALOG_FILE = 'catalog.json'
+
+
+class ExportCatalog:
+
+    def __init__(self, export_dir, hash_files=True):
+        """
+        :param hash_files: compute the sha256 of new or changed zips. The download server builds a catalog without
+        hashes when the exporter hasn't written one yet.
+        """
+        self.export_dir = export_dir
+        self.hash_files = hash_files
+        self._books = None
+
+    @property
+    def books(self):
+        if self._books is None:
+            self.load()
+        return self._books
+
+    def _read(self):
+        try:
+            with open(os.path.join(self.export_dir, CATALOG_FILE)) as fp:
+                return json.load(fp)['books']
+        except FileNotFoundError:
+            return None
+
+    def load(self):
+        self._books = self._read()
+        if self._books is None:
+            self._books = {}
+            self.scan()
+        return self
+
+    def _entry(self, title, stat):
+        old = (self._books or {}).get(title)
+        if old and old['size'] == stat.st_size and old['mtime'] == stat.st_mtime:
+            return old
+        return {
+            'size': stat.st_size,
+            'mtime': stat.st_mtime,
+            'sha256': file_sha256(os.path.join(self.export_dir, f'{title}.zip')) if self.hash_files else None,
+        }
+
+    def update(self, titles):
+        """
+        Refreshes the entries of `titles`, e.g. after exporting them. Hashes are only recomputed for changed zips.
+        """
+        books = self.books
+        for title in titles:
+            entry = self.entry(title)
+            if entry:
+                books[title] = entry
+            else:
+                books.pop(title, None)
+        return self
+
+    def entry(self, title):
+        """
+        :return: the current entry of `title`'s zip, None if there is no zip. Doesn't load the catalog, so unless it is
+        already loaded the zip is hashed. Export worker processes use this to hand their zips' entries to the parent.
+        """
+        try:
+            return self._entry(title, os.stat(os.path.join(self.export_dir, f'{title}.zip')))
+        except FileNotFoundError:
+            return None
+
+    def scan(self):
+        """
+        Rebuilds the catalog from every zip in the export directory. Zips whose size and mtime match the saved catalog
+        keep their recorded hash.
+        """
+        if self._books is None:
+            self._books = self._read() or {}
+        books = {}
+        try:
+            entries = list(os.scandir(self.export_dir))
+        except FileNotFoundError:
+            entries = []
+        for entry in entries:
+            if entry.name.endswith('.zip') and entry.is_file():
+                title = entry.name[:-4]
+                books[title] = self._entry(title, entry.stat())
+        self._books = books
+        return self
+
+    def save(self):
+        write_json_atomic(os.path.join(self.export_dir, CATALOG_FILE), {'books': self.books})
+        return self
+
+    def titles(self):
+        return list(self.books.keys())
+
+
+class CatalogCache(FileCache):
+    """
+    In-memory export catalogs for the download server, by export directory: dicts of title -> {'size', 'mtime',
+    'sha256'}. A catalog is built on first use and reloaded when the exporter saves a new `catalog.json`. Until the
+    exporter has saved a catalog, the export directory is scanned again on every check.
+    """
+
+    def file_path(self, export_dir):
+        return os.path.join(export_dir, CATALOG_FILE)
+
+    def load(self, export_dir):
+        with open(self.file_path(export_dir)) as fp:
+            return json.load(fp)['books']
+
+    def load_missing(self, export_dir):
+        return ExportCatalog(export_dir, hash_files=False).scan().books
@@ -0,0 +1,180 @@
+# encoding=utf-8
+"""
+The parts of the export that the download server needs: export layout, bundle building and cleanup, and package
+metadata. This module must not import Django or the Sefaria model, so the server can use it without booting Django;
+JsonExporterForIOS re-exports everything here.
+"""
+
+import os
+import json
+import zipfile
+import heapq
+from math import ceil
+from shutil import rmtree
+from local_settings import SEFARIA_EXPORT_PATH
+from file_cache import file_sha256
+from bundle_manifest import write_manifest
+
+PREV_SCHEMA_VERSION = "6"  # for clearing old bundles so space on disk doesn't run out
+SCHEMA_VERSION = "7"  # alternate versions offline
+
+TOC_PATH          = "/toc.json"
+SEARCH_TOC_PATH   = "/search_toc.json"
+TOPIC_TOC_PATH    = "/topic_toc.json"
+HEB_CATS_PATH     = "/hebrew_categories.json"
+PEOPLE_PATH       = "/people.json"
+PACK_PATH         = "/packages.json"
+CALENDAR_PATH     = "/calendar.json"
+LAST_UPDATED_PATH = "/last_updated.json"
+MAX_FILE_SIZE = 100e6
+BUNDLE_PATH = "/bundles"
+SHARD_PATH = "/shards"
+SHARD_SIZE = 25e6
+
+
+def get_export_path(schema_version):
+    return f"{SEFARIA_EXPORT_PATH}/{schema_version}"
+
+
+def get_last_updated_path(schema_version):
+    return get_export_path(schema_version) + LAST_UPDATED_PATH
+
+
+def get_bundle_path(schema_version):
+    return get_export_path(schema_version) + BUNDLE_PATH
+
+
+def get_shard_path(schema_version):
+    return get_export_path(schema_version) + SHARD_PATH
+
+
+def keep_directory(func):
+    def new_func(*args, **kwargs):
+        original_dir = os.getcwd()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            os.chdir(original_dir)
+    return new_func
+
+
+def read_packages(schema_version):
+    """
+    :return: contents of packages.json for `schema_version`, or an empty list if the packages weren't exported yet
+    """
+    try:
+        with open(get_export_path(schema_version) + PACK_PATH) as fp:
+            return json.load(fp)
+    except FileNotFoundError:
+        return []
+
+
+def plan_balanced_parts(sizes, num_parts):
+    """
+    Packs books into `num_parts` parts of roughly equal size, largest book first into the currently smallest part.
+    :param sizes: list of (title, size) in bundle order
+    :return: list of parts, each a list of titles in their original order
+    """
+    order = {title: i for i, (title, _) in enumerate(sizes)}
+    heap = [(0, i) for i in range(min(num_parts, len(sizes)))]
+    parts = [[] for _ in heap]
+    for title, size in sorted(sizes, key=lambda x: -x[1]):
+        load, i = heapq.heappop(heap)
+        parts[i].append(title)
+        heapq.heappush(heap, (load + size, i))
+    return [sorted(part, key=order.get) for part in parts]
+
+
+def plan_split_archive(book_list, export_dir='', archive_size=MAX_FILE_SIZE, num_parts=None, part_size=None):
+    """
+    Splits `book_list` into the parts of a split archive up front, from the sizes of the book zips, so that the parts
+    can be written independently.
+    By default a part is closed once it passes `archive_size`. If `num_parts` or a target `part_size` is given the
+    books are instead balanced over that many roughly equal parts, which suits clients downloading parts in parallel.
+    :return: list of parts, each a list of book zip names
+    """
+    sizes = []
+    for title in book_list:
+        try:
+            sizes.append((title, os.path.getsize(os.path.join(export_dir, title))))
+        except FileNotFoundError:
+            print(f"No zip file for {title}; the bundles will be missing this text")
+    if num_parts or part_size:
+        if not num_parts:
+            num_parts = max(1, ceil(sum(size for _, size in sizes) / part_size))
+        return plan_balanced_parts(sizes, num_parts)
+
+    parts, current, current_size = [], [], 0
+    for title, size in sizes:
+        current.append(title)
+        current_size += size
+        if current_size > archive_size:
+            parts.append(current)
+            current, current_size = [], 0
+    if current:
+        parts.append(current)
+    return parts
+
+
+def write_archive_part(filename, titles, export_dir, compression):
+    """
+    Writes one part of a split archive. Runs in a worker process when building in parallel.
+    :return: sha256 of the part
+    """
+    with zipfile.ZipFile(filename, 'w', compression) as z:
+        for title in titles:
+            z.write(os.path.join(export_dir, title), arcname=title)
+    return file_sha256(filename)
+
+
+def build_split_archive(book_list, build_loc, export_dir='', archive_size=MAX_FILE_SIZE, compression=zipfile.ZIP_DEFLATED,
+                        executor=None, num_parts=None, part_size=None):
+    """
+    Packs the book zips in `book_list` into numbered archives of roughly `archive_size` bytes in `build_loc`.
+    :param compression: zipfile compression for the archives. The book zips are already deflated, so ZIP_STORED
+    produces nearly the same size without spending CPU on compressing them again.
+    :param executor: optional ProcessPoolExecutor to write the parts concurrently
+    :param num_parts: build this many equally sized parts instead (see plan_split_archive)
+    :param part_size: build equally sized parts of about this many bytes instead (see plan_split_archive)
+    """
+    if os.path.exists(build_loc):
+        try:
+            rmtree(build_loc)
+        except NotADirectoryError:
+            os.remove(build_loc)
+    os.mkdir(build_loc)
+    parts = plan_split_archive(book_list, export_dir, archive_size, num_parts, part_size)
+    filenames = [f'{i}.zip' for i in range(1, len(parts) + 1)]
+    args = [(f'{build_loc}/{filename}', titles, export_dir, compression) for filename, titles in zip(filenames, parts)]
+    if executor:
+        hashes = [f.result() for f in [executor.submit(write_archive_part, *a) for a in args]]
+    else:
+        hashes = [write_archive_part(*a) for a in args]
+
+    write_manifest(build_loc, filenames, dict(zip(filenames, hashes)))
+    return filenames
+
+
+@keep_directory
+def clear_old_bundles(schema_version, max_files=50):
+    """
+    This method will check the bundles directory and clean out old bundles (this would be updates that aren't being used)
+    :param old_age: bundles not served in this number of days will be deleted
+    :param max_files: if less than this many files exist, nothing will happen
+    :return:
+    """
+    os.chdir(get_bundle_path(schema_version))
+    # get packages
+    with open('../packages.json') as fp:
+        packages = json.load(fp)
+    packages = set(p['en'] for p in packages)
+    # list all non package bundles, skipping lease files and builds in progress (hidden) like the server's cache sweep
+    bundles = [s for s in os.listdir('.') if s not in packages and not s.startswith('.') and os.path.isdir(s)]
+    if len(bundles) < max_files:
+        return
+    # for each package if old, delete
+    for bundle in bundles:
+        try:
+            rmtree(bundle)
+        except FileNotFoundError:
+            pass
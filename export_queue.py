@@ -0,0 +1,131 @@
+# encoding=utf-8
+"""
+Queue directory through which the download server hands export jobs to the export worker (export_worker.py).
+
+    <queue>/pending/<job id>.json   jobs waiting for the worker
+    <queue>/status/<job id>.json    status of every job: queued, running, done or failed
+    <queue>/worker.json             the worker's heartbeat
+
+A job that is submitted while an identical job (same action and index) is still pending is coalesced into it, so
+repeated /update calls for the same title run one export. This module doesn't import the exporter, so the download
+server can use it without booting Django.
+"""
+
+import os
+import json
+import time
+import uuid
+from file_cache import write_json_atomic
+try:
+    from local_settings import EXPORT_QUEUE_PATH
+except ImportError:
+    EXPORT_QUEUE_PATH = './export_queue'
+try:
+    from local_settings import EXPORT_WORKER_TIMEOUT
+except ImportError:
+    EXPORT_WORKER_TIMEOUT = 60  # seconds without a heartbeat after which the worker is considered down
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+WORKER_FILE = 'worker.json'
+# actions that run until stopped. They would hold up every job queued after them, so they aren't run through /update
+# or the queue; start them as their own process, e.g. `python JsonExporterForIOS.py export_watch`.
+LONG_RUNNING_ACTIONS = {'export_watch'}
+
+
+def _read_json(path):
+    try:
+        with open(path) as fp:
+            return json.load(fp)
+    except (FileNotFoundError, ValueError):  # ValueError: removed or replaced while reading
+        return None
+
+
+class ExportQueue:
+
+    def __init__(self, queue_dir=EXPORT_QUEUE_PATH, keep_finished=7 * 86400):
+        """
+        :param keep_finished: seconds the status of a finished job is kept
+        """
+        self.queue_dir = queue_dir
+        self.pending_dir = os.path.join(queue_dir, 'pending')
+        self.status_dir = os.path.join(queue_dir, 'status')
+        self.keep_finished = keep_finished
+
+    def _ensure_dirs(self):
+        os.makedirs(self.pending_dir, exist_ok=True)
+        os.makedirs(self.status_dir, exist_ok=True)
+
+    def submit(self, action, index=''):
+        """
+        Queues `action` for `index`, or returns the pending job that already does the same.
+        :return: status of the job
+        """
+        self._ensure_dirs()
+        for job in self.pending():
+            if job['action'] == action and job['index'] == index:
+                return self.get_status(job['id']) or job
+        job = {'id': uuid.uuid4().hex, 'action': action, 'index': index, 'submitted': time.time()}
+        status = {**job, 'status': QUEUED, 'error': None, 'started': None, 'finished': None}
+        write_json_atomic(os.path.join(self.status_dir, f'{job["id"]}.json'), status)
+        write_json_atomic(os.path.join(self.pending_dir, f'{job["id"]}.json'), job)
+        return status
+
+    def pending(self):
+        """
+        :return: pending jobs, oldest first
+        """
+        try:
+            names = [f for f in os.listdir(self.pending_dir) if f.endswith('.json') and not f.startswith('.')]
+        except FileNotFoundError:
+            return []
+        jobs = [_read_json(os.path.join(self.pending_dir, name)) for name in names]
+        return sorted((job for job in jobs if job), key=lambda job: job['submitted'])
+
+    def claim(self, job):
+        """
+        Removes `job` from the pending jobs.
+        :return: False if another worker claimed it first
+        """
+        try:
+            os.remove(os.path.join(self.pending_dir, f'{job["id"]}.json'))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def get_status(self, job_id):
+        if not job_id or os.path.basename(job_id) != job_id:
+            return None
+        return _read_json(os.path.join(self.status_dir, f'{job_id}.json'))
+
+    def set_status(self, job_id, status, **fields):
+        path = os.path.join(self.status_dir, f'{job_id}.json')
+        doc = _read_json(path) or {'id': job_id}
+        doc.update(fields, status=status)
+        write_json_atomic(path, doc)
+
+    def prune(self):
+        now = time.time()
+        try:
+            names = os.listdir(self.status_dir)
+        except FileNotFoundError:
+            return
+        for name in names:
+            status = _read_json(os.path.join(self.status_dir, name))
+            if status and status.get('finished') and now - status['finished'] > self.keep_finished:
+                try:
+                    os.remove(os.path.join(self.status_dir, name))
+                except FileNotFoundError:
+                    pass
+
+    def heartbeat(self, current_job=None):
+        self._ensure_dirs()
+        write_json_atomic(os.path.join(self.queue_dir, WORKER_FILE),
+                          {'pid': os.getpid(), 'time': time.time(), 'job': current_job})
+
+    def is_worker_alive(self, timeout=EXPORT_WORKER_TIMEOUT):
+        worker = _read_json(os.path.join(self.queue_dir, WORKER_FILE))
+        return bool(worker) and time.time() - worker['time'] < timeout
@@ -0,0 +1,81 @@
+# encoding=utf-8
+"""
+Long-running export worker. Django and the Sefaria library are loaded once at startup instead of once per /update
+call. Jobs queued by the download server (see export_queue.py) run one at a time, and identical jobs that queued up
+while another job was running are run once for all of them.
+
+    python export_worker.py
+"""
+
+import time
+import threading
+import traceback
+from export_queue import ExportQueue, EXPORT_WORKER_TIMEOUT, LONG_RUNNING_ACTIONS, RUNNING, DONE, FAILED
+import JsonExporterForIOS as exporter
+try:
+    from local_settings import EXPORT_WORKER_POLL_INTERVAL
+except ImportError:
+    EXPORT_WORKER_POLL_INTERVAL = 2
+
+
+def take_batch(queue):
+    """
+    Claims the oldest pending job together with every pending job identical to it.
+    :return: list of claimed jobs, empty if nothing is pending
+    """
+    jobs = queue.pending()
+    if not jobs:
+        return []
+    key = (jobs[0]['action'], jobs[0]['index'])
+    return [job for job in jobs if (job['action'], job['index']) == key and queue.claim(job)]
+
+
+def run_batch(queue, batch):
+    job_ids = [job['id'] for job in batch]
+    action, index = batch[0]['action'], batch[0]['index']
+    if action in LONG_RUNNING_ACTIONS:  # /update refuses these, but the queue directory can be written to directly
+        for job_id in job_ids:
+            queue.set_status(job_id, FAILED, error=f'{action} runs until stopped, start it with '
+                                                    f'`python JsonExporterForIOS.py {action}`', finished=time.time())
+        return
+    print(f'Running {action} {index} for jobs {", ".join(job_ids)}')
+    for job_id in job_ids:
+        queue.set_status(job_id, RUNNING, started=time.time())
+
+    # the heartbeat has to continue while a long export runs, or the server would consider the worker down
+    stop = threading.Event()
+
+    def beat():
+        while not stop.wait(EXPORT_WORKER_TIMEOUT / 3):
+            queue.heartbeat(job_ids[0])
+    heartbeat = threading.Thread(target=beat, daemon=True)
+    heartbeat.start()
+    try:
+        # picks up books added to the library since the last job, like a fresh exporter process would
+        exporter.model.library.rebuild_toc()
+        exporter.run_action(action, index or None)
+    except Exception as e:
+        print(traceback.format_exc())
+        status, error = FAILED, str(e)
+    else:
+        status, error = DONE, None
+    finally:
+        stop.set()
+        heartbeat.join()
+    for job_id in job_ids:
+        queue.set_status(job_id, status, error=error, finished=time.time())
+
+
+def serve(queue):
+    while True:
+        queue.heartbeat()
+        batch = take_batch(queue)
+        if batch:
+            run_batch(queue, batch)
+            queue.prune()
+        else:
+            time.sleep(EXPORT_WORKER_POLL_INTERVAL)
+
+
+if __name__ == '__main__':
+    serve(ExportQueue())
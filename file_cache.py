@@ -0,0 +1,147 @@
+# encoding=utf-8
+"""
+File helpers shared by the exporter and the download server: content hashes, atomic writes and in-memory caches of
+values loaded from files that are reloaded when the files change. This module must not import metrics, so exporter
+processes don't register Prometheus metrics.
+"""
+
+import os
+import json
+import time
+import uuid
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(chunk_size), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def write_file_atomic(path, data):
+    """
+    Writes the bytes `data` to a temporary file next to `path` and renames it over `path`, so readers never see a
+    partially written file. Concurrent writers each use their own temporary file.
+    """
+    tmp_path = os.path.join(os.path.dirname(path), f'.{os.path.basename(path)}.{uuid.uuid4().hex}.tmp')
+    try:
+        with open(tmp_path, 'wb') as fp:
+            fp.write(data)
+        os.replace(tmp_path, path)
+    except Exception:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def write_json_atomic(path, doc):
+    write_file_atomic(path, json.dumps(doc).encode('utf-8'))
+
+
+class FileCache:
+    """
+    Keeps values loaded from files in memory, reloading a value when its file's mtime changes. The mtime is checked at
+    most once every `recheck_interval` seconds. Subclasses implement `load` and may override `file_path`,
+    `load_missing` and `is_current`.
+    """
+
+    def __init__(self, recheck_interval=30, max_entries=None):
+        """
+        :param max_entries: number of values kept, dropping the least recently used beyond it. None keeps all values.
+        """
+        self.recheck_interval = recheck_interval
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (file mtime, time checked, value)
+        self._lock = threading.Lock()
+
+    def file_path(self, key):
+        """
+        :return: the file whose mtime tells whether the value of `key` changed
+        """
+        return key
+
+    def load(self, key):
+        raise NotImplementedError
+
+    def load_missing(self, key):
+        """
+        :return: the value of `key` when its file doesn't exist. None values aren't cached.
+        """
+        return None
+
+    def is_current(self, key):
+        """
+        Check made on every cache hit, for values that can go away before their file's mtime is checked again.
+        """
+        return True
+
+    def get(self, key):
+        """
+        :return: the value of `key`, or None if its file doesn't exist and there is no value without it
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            fresh = entry is not None and now - entry[1] < self.recheck_interval
+            if fresh:
+                self._entries.move_to_end(key)
+        if fresh and self.is_current(key):
+            return entry[2]
+        try:
+            mtime = os.stat(self.file_path(key)).st_mtime
+            value = entry[2] if entry and entry[0] == mtime else self.load(key)
+        except FileNotFoundError:
+            mtime, value = None, self.load_missing(key)
+        if value is None:
+            self.invalidate(key)
+            return None
+        with self._lock:
+            self._entries[key] = (mtime, now, value)
+            self._entries.move_to_end(key)
+            while self.max_entries and len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+class FileHashCache:
+    """
+    Remembers the sha256 of files, recomputing it only when a file's size or mtime changes.
+    """
+
+    def __init__(self, max_entries=4096):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # path -> (mtime_ns, size, sha256)
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        stat = os.stat(path)
+        with self._lock:
+            entry = self._entries.get(path)
+        if entry and entry[:2] == (stat.st_mtime_ns, stat.st_size):
+            return entry[2]
+        sha256 = file_sha256(path)
+        with self._lock:
+            self._entries[path] = (stat.st_mtime_ns, stat.st_size, sha256)
+            self._entries.move_to_end(path)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return sha256
+
+class JsonFileCache(FileCache):
+    """
+    Keeps parsed json files in memory, by path, reloading a file when its mtime changes.
+    """
+
+    def load(self, path):
+        with open(path) as fp:
+            return json.load(fp)
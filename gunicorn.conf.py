@@ -0,0 +1,47 @@
+# gunicorn loads this file from the working directory on startup.
+import os
+import sys
+import shutil
+import subprocess
+
+# metrics are shared between workers through this directory (see metrics.py). It has to be set before any worker
+# imports prometheus_client.
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', '/tmp/prometheus-multiproc')
+
+# /makeBundle requests with `wait` are held open until their bundle is built. Threaded workers serve other requests
+# in the meantime instead of blocking a whole worker process per waiting client.
+try:
+    from local_settings import GUNICORN_THREADS
+except ImportError:
+    GUNICORN_THREADS = 8
+worker_class = 'gthread'
+threads = GUNICORN_THREADS
+
+# the export worker (export_worker.py) runs the exports requested through /update with the library kept loaded
+try:
+    from local_settings import EXPORT_WORKER_AUTOSTART
+except ImportError:
+    EXPORT_WORKER_AUTOSTART = True
+export_worker = None
+
+
+def on_starting(server):
+    # values left over from a previous run would be added to the new ones
+    shutil.rmtree(os.environ['PROMETHEUS_MULTIPROC_DIR'], ignore_errors=True)
+    os.makedirs(os.environ['PROMETHEUS_MULTIPROC_DIR'])
+
+
+def when_ready(server):
+    global export_worker
+    if EXPORT_WORKER_AUTOSTART:
+        export_worker = subprocess.Popen([sys.executable, 'export_worker.py'])
+
+
+def on_exit(server):
+    if export_worker:
+        export_worker.terminate()
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,136 @@
+# encoding=utf-8
+"""
+Serializes the exported json documents. Every encoder returns the utf-8 bytes of
+
+    json.dumps(doc, ensure_ascii=False, indent=(None if minify else 4), separators=((',',':') if minify else None))
+
+so switching encoders doesn't change the exported files, their hashes or the shards built from them.
+
+OrjsonEncoder is used when orjson is installed. orjson only indents by two spaces, so its output is re-indented, and
+it formats some floats differently (1e-05 as 0.00001, 1e+16 as 1e16), so documents whose output might contain such a
+float are encoded with the standard library instead. orjson also writes NaN and infinity as null, so documents whose
+output contains null are checked for such floats and encoded with the standard library if they hold one.
+VerifyingEncoder additionally compares every document against the standard library.
+"""
+
+import json
+import math
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    from local_settings import JSON_ENCODER
+except ImportError:
+    JSON_ENCODER = 'auto'  # 'auto' uses orjson when it's installed, 'orjson' requires it, 'json' is the standard library
+try:
+    from local_settings import JSON_ENCODER_VERIFY
+except ImportError:
+    JSON_ENCODER_VERIFY = False  # check every document against the standard library, writing its output on mismatch
+
+# floats orjson formats differently are in exponent notation (a digit followed by e) or below 1e-4 (0.0000...). The
+# check also matches inside strings, which only costs those documents the slower encoder. Digits are mapped to 0 so
+# one substring search finds a digit followed by e; a regular expression scans the output several times slower.
+_DIGITS_TO_ZERO = bytes.maketrans(b'123456789', b'000000000')
+
+
+def _may_contain_unsafe_float(encoded):
+    return b'0.0000' in encoded or b'0e' in encoded.translate(_DIGITS_TO_ZERO)
+
+
+def _has_non_finite_float(value):
+    if isinstance(value, float):
+        return not math.isfinite(value)
+    if isinstance(value, dict):
+        return any(_has_non_finite_float(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return any(_has_non_finite_float(v) for v in value)
+    return False
+
+
+def _double_indent(encoded):
+    """
+    Re-indents orjson's two space indentation to four spaces. orjson escapes newlines inside strings, so every line
+    break is followed by indentation only. Pass k adds two spaces to the lines at depth k or deeper.
+    """
+    depth = 1
+    while True:
+        indent = b'\n' + b' ' * (4 * depth - 2)
+        if indent not in encoded:
+            return encoded
+        encoded = encoded.replace(indent, indent + b'  ')
+        depth += 1
+
+
+class StdlibEncoder:
+    name = 'json'
+
+    def __init__(self, minify):
+        self.minify = minify
+
+    def encode(self, doc):
+        if self.minify:
+            return json.dumps(doc, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        return json.dumps(doc, ensure_ascii=False, indent=4).encode('utf-8')
+
+
+class OrjsonEncoder:
+    name = 'orjson'
+
+    def __init__(self, minify):
+        self.minify = minify
+        self.option = orjson.OPT_NON_STR_KEYS | (0 if minify else orjson.OPT_INDENT_2)
+        self.fallback = StdlibEncoder(minify)
+
+    def encode(self, doc):
+        try:
+            encoded = orjson.dumps(doc, option=self.option)
+        except TypeError:  # e.g. an integer beyond 64 bits. Let the standard library serialize it or raise.
+            return self.fallback.encode(doc)
+        if _may_contain_unsafe_float(encoded) or (b'null' in encoded and _has_non_finite_float(doc)):
+            return self.fallback.encode(doc)
+        return encoded if self.minify else _double_indent(encoded)
+
+
+class VerifyingEncoder:
+    """
+    Encodes with `encoder` and checks the output against the standard library. On a mismatch the standard library's
+    output is returned, so the output is always identical to it.
+    """
+
+    def __init__(self, encoder):
+        self.encoder = encoder
+        self.name = f'{encoder.name} (verified)'
+        self.reference = StdlibEncoder(encoder.minify)
+        self.mismatches = 0
+
+    def encode(self, doc):
+        expected = self.reference.encode(doc)
+        try:
+            encoded = self.encoder.encode(doc)
+        except TypeError:
+            encoded = None
+        if encoded != expected:
+            self.mismatches += 1
+            position = next((i for i, (a, b) in enumerate(zip(encoded or b'', expected)) if a != b), None)
+            print(f'{self.encoder.name} output differs from json at byte {position}: '
+                  f'{expected[max((position or 0) - 40, 0):(position or 0) + 40]!r}')
+        return expected
+
+
+def get_encoder(minify, name=JSON_ENCODER, verify=JSON_ENCODER_VERIFY):
+    """
+    :param minify: MINIFY_JSON
+    :param name: 'auto', 'orjson' or 'json'
+    """
+    if name == 'auto':
+        name = 'orjson' if orjson else 'json'
+    if name == 'orjson':
+        if orjson is None:
+            raise ImportError("JSON_ENCODER is 'orjson' but orjson isn't installed")
+        encoder = OrjsonEncoder(minify)
+    elif name == 'json':
+        encoder = StdlibEncoder(minify)
+    else:
+        raise ValueError(f'Unknown json encoder {name}')
+    return VerifyingEncoder(encoder) if verify and name != 'json' else encoder
@@ -19,3 +19,25 @@ CLOUDFLARE_EMAIL = ""
 CLOUDFLARE_TOKEN = ""
 CLOUDFLARE_PATH = "http://readonly.sefaria.org/static/ios-export"
 DEBUG_MODE = False
+BUNDLE_BUILD_WORKERS = 2  # number of ad-hoc bundles the download server builds concurrently
+BUNDLE_CACHE_MAX_BYTES = 10e9  # ad-hoc bundles are evicted least-recently-used first once they pass this size
+BUNDLE_CACHE_SWEEP_INTERVAL = 300  # seconds between background bundle cache sweeps
+MANIFEST_RECHECK_INTERVAL = 30  # seconds a cached bundle manifest is served before its mtime is checked again
+BUNDLE_LEASE_TTL = 60  # seconds without a heartbeat after which another worker takes over a bundle build
+MAX_BUNDLE_WAIT = 30  # longest time in seconds a /makeBundle request with `wait` is held open for its build
+GUNICORN_THREADS = 8  # request threads per gunicorn worker, so requests waiting for a build don't block the worker
+BUILD_PROCESSES = None  # worker processes for building package bundles; None uses every core
+EXPORT_PROCESSES = 1  # worker processes for exporting texts in parallel during export_all
+PACKAGE_PARTS = {}  # package name -> number of equally sized parts for its bundle, e.g. {"COMPLETE LIBRARY": 8}
+EXPORT_QUEUE_PATH = './export_queue'  # queue directory shared by the download server and the export worker
+EXPORT_WORKER_TIMEOUT = 60  # seconds without a heartbeat after which /update falls back to a one-off exporter process
+EXPORT_WORKER_POLL_INTERVAL = 2  # seconds between checks of the export queue
+EXPORT_WORKER_AUTOSTART = True  # start export_worker.py together with gunicorn
+JSON_ENCODER = 'auto'  # 'auto' uses orjson when it's installed, 'orjson' requires it, 'json' is the standard library
+JSON_ENCODER_VERIFY = False  # check every exported document against the standard library's output
+PARTIAL_EXPORTS = True  # export_updated exports again only the sections of a text that changed since its last export
+EXPORT_WATERMARK_PATH = './export_watermark.json'  # date up to which all history has been exported
+EXPORT_WATCH_INTERVAL = 30  # seconds between reads of new history in export_watch
+EXPORT_WATCH_DEBOUNCE = 120  # seconds without new edits after which export_watch exports a book
+EXPORT_WATCH_MAX_DELAY = 900  # longest time in seconds a book that keeps being edited waits for its export
+EXPORT_WATCH_BUNDLE_INTERVAL = 3600  # shortest time in seconds between package bundle and shard rebuilds in export_watch
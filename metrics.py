@@ -0,0 +1,37 @@
+# encoding=utf-8
+"""
+Prometheus metrics for the download server and the bundle builder.
+
+Under gunicorn every worker is a separate process. When PROMETHEUS_MULTIPROC_DIR is set (see gunicorn.conf.py)
+prometheus_client keeps the values in files in that directory and /metrics aggregates the values of all workers,
+so counters don't reset or jump around depending on which worker answers the scrape.
+"""
+
+import os
+from prometheus_client import Counter, Gauge, Histogram, CollectorRegistry, REGISTRY, generate_latest, multiprocess
+
+SIZE_BUCKETS = (1e5, 1e6, 1e7, 2.5e7, 5e7, 1e8, 2.5e8, 5e8, 1e9, 2.5e9, float('inf'))
+DURATION_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, float('inf'))
+
+REQUEST_LATENCY = Histogram('download_server_request_seconds', 'Request latency', ['route', 'method', 'status'])
+BUNDLE_REQUESTS = Counter('bundle_requests_total', 'Bundle requests by outcome: hit, shards (answered by shards only) or miss', ['outcome'])
+BUNDLE_EVICTIONS = Counter('bundle_cache_evictions_total', 'Ad-hoc bundles evicted from the bundle cache')
+BUNDLE_EVICTED_BYTES = Counter('bundle_cache_evicted_bytes_total', 'Bytes of ad-hoc bundles evicted from the bundle cache')
+BUNDLE_SWEEP_SECONDS = Histogram('bundle_cache_sweep_seconds', 'Time spent in a bundle cache sweep', buckets=DURATION_BUCKETS)
+BUNDLE_BUILD_SECONDS = Histogram('bundle_build_seconds', 'Time spent building a bundle', buckets=DURATION_BUCKETS)
+BUNDLE_BUILD_FAILURES = Counter('bundle_build_failures_total', 'Bundle builds that raised an exception')
+BUNDLE_SIZE_BYTES = Histogram('bundle_size_bytes', 'Size of built bundles', buckets=SIZE_BUCKETS)
+BUNDLE_BYTES_WRITTEN = Counter('bundle_bytes_written_total', 'Bytes written to disk by bundle builds')
+BUNDLE_JOBS = Gauge('bundle_build_jobs', 'Bundle build jobs by state (queue depth)', ['state'], multiprocess_mode='livesum')
+
+
+def generate():
+    """
+    :return: all metrics in the Prometheus text format, aggregated over all workers in multiprocess mode
+    """
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry)
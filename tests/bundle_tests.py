@@ -0,0 +1,234 @@
+import os
+import sys
+import hashlib
+import subprocess
+import threading
+from shutil import rmtree
+import pytest
+import bundle_jobs
+import bundle_cache
+import bundle_manifest
+import bundle_shards
+import export_catalog
+import export_common
+import build_lease
+
+
+@pytest.fixture()
+def scheduler():
+    return bundle_jobs.BuildScheduler(max_workers=1)
+
+
+def test_scheduler_attaches_to_active_job(scheduler):
+    release = threading.Event()
+    calls = []
+
+    def build(name):
+        calls.append(name)
+        release.wait(5)
+
+    job = scheduler.submit('7/abc', build, 'abc')
+    assert scheduler.submit('7/abc', build, 'abc') is job
+    assert not job.wait(0.01)
+    release.set()
+    assert job.wait(5)
+    assert job.status == bundle_jobs.DONE
+    assert calls == ['abc']
+
+
+def test_scheduler_reports_failure(scheduler):
+    def build():
+        raise ValueError('boom')
+
+    job = scheduler.submit('7/bad', build)
+    scheduler._executor.shutdown(wait=True)
+    assert job.status == bundle_jobs.FAILED
+    assert job.error == 'boom'
+    assert scheduler.get('7/bad') is job
+
+
+def test_bundle_cache_evicts_least_recently_used(tmp_path):
+    root = tmp_path / 'bundles'
+    root.mkdir()
+    (tmp_path / 'packages.json').write_text('[{"en": "PACKAGE"}]')
+    for i, name in enumerate(['PACKAGE', 'old', 'recent', 'newest']):
+        (root / name).mkdir()
+        (root / name / '1.zip').write_bytes(b'x' * 100)
+        os.utime(root / name, (1000 + i, 1000 + i))
+    cache = bundle_cache.BundleCacheManager([str(root)], max_bytes=200)
+    cache.touch(str(root / 'old'))
+
+    evicted = cache.sweep()
+    assert evicted == [str(root / 'recent')]
+    assert sorted(os.listdir(root)) == ['PACKAGE', 'newest', 'old']
+
+
+def test_bundle_cache_measures_republished_bundles(tmp_path):
+    root = tmp_path / 'bundles'
+    (root / 'bundle').mkdir(parents=True)
+    (root / 'bundle' / '1.zip').write_bytes(b'x' * 100)
+    cache = bundle_cache.BundleCacheManager([str(root)], max_bytes=150)
+    assert cache.sweep() == []
+
+    (root / 'new').mkdir()
+    (root / 'new' / '1.zip').write_bytes(b'x' * 200)
+    os.rename(root / 'bundle', root / 'old')  # swapped in like create_zip_bundle does
+    os.rename(root / 'new', root / 'bundle')
+    rmtree(root / 'old')
+    assert cache.sweep() == [str(root / 'bundle')]
+
+
+def test_bundle_cache_sees_other_workers_accesses(tmp_path):
+    root = tmp_path / 'bundles'
+    for i, name in enumerate(['served', 'idle']):
+        (root / name).mkdir(parents=True)
+        (root / name / '1.zip').write_bytes(b'x' * 100)
+        os.utime(root / name, (1000 + i, 1000 + i))
+    serving = bundle_cache.BundleCacheManager([str(root)], max_bytes=100)
+    serving.touch(str(root / 'served'))
+    assert bundle_cache.BundleCacheManager([str(root)], max_bytes=100).sweep() == [str(root / 'idle')]
+
+    os.utime(root / 'served', (1000, 1000))
+    serving.touch(str(root / 'served'))  # throttled, the last access was written moments ago
+    assert os.path.getmtime(root / 'served') == 1000
+
+
+def test_manifest_cache(tmp_path):
+    (tmp_path / '1.zip').write_bytes(b'abc')
+    bundle_manifest.write_manifest(str(tmp_path), ['1.zip'])
+    cache = bundle_manifest.ManifestCache(recheck_interval=0)
+    manifest = cache.get(str(tmp_path))
+    assert manifest['size'] == 3
+    assert manifest['parts'][0]['sha256'] == hashlib.sha256(b'abc').hexdigest()
+
+    (tmp_path / '2.zip').write_bytes(b'de')
+    bundle_manifest.write_manifest(str(tmp_path), ['1.zip', '2.zip'])
+    os.utime(tmp_path / bundle_manifest.MANIFEST_FILE, (2000, 2000))
+    assert [p['name'] for p in cache.get(str(tmp_path))['parts']] == ['1.zip', '2.zip']
+    assert cache.get(str(tmp_path / 'missing')) is None
+
+    cache.recheck_interval = 3600
+    assert cache.get(str(tmp_path))['size'] == 5
+    rmtree(tmp_path)  # evicted by another worker
+    assert cache.get(str(tmp_path)) is None
+
+
+def test_plan_balanced_parts():
+    sizes = [(f'{i}.zip', size) for i, size in enumerate([50, 10, 30, 30, 20, 20, 40, 5, 5])]
+    parts = export_common.plan_balanced_parts(sizes, 3)
+    assert sorted(t for part in parts for t in part) == sorted(t for t, _ in sizes)
+    size_by_title = dict(sizes)
+    part_sizes = [sum(size_by_title[t] for t in part) for part in parts]
+    assert max(part_sizes) - min(part_sizes) <= 10
+    assert len(export_common.plan_balanced_parts(sizes[:2], 5)) == 2
+
+
+def test_shards_align_with_packages():
+    titles = [f'Book {i}' for i in range(40)]
+    sizes = {t: 10 for t in titles}
+    packages = [{'en': 'COMPLETE LIBRARY'}, {'en': 'SMALL', 'indexes': titles[:7]}, {'en': 'TINY', 'indexes': titles[:2]}]
+    shards = bundle_shards.plan_shards(titles, sizes, packages, shard_size=30)
+    assert sorted(t for shard in shards for t in shard) == sorted(titles)
+
+    index = bundle_shards.ShardIndex({'id': 'x', 'shards': [{'id': str(i), 'books': s} for i, s in enumerate(shards)]})
+    for package_titles in (titles[:7], titles[:2], titles):
+        covering, remainder = index.cover(package_titles)
+        assert remainder == []
+        assert sorted(t for s in covering for t in s['books']) == sorted(package_titles)
+    covering, remainder = index.cover(titles[:2] + ['Book 39', 'Unknown'])
+    assert 'Unknown' in remainder
+    assert not set(titles[:2]) & set(remainder)
+
+
+def test_build_shards_hashes_only_new_shards(tmp_path, monkeypatch):
+    export_dir, shard_dir = tmp_path / 'export', tmp_path / 'shards'
+    export_dir.mkdir()
+    books = {}
+    for title in ('Genesis', 'Exodus'):
+        (export_dir / f'{title}.zip').write_bytes(title.encode('utf-8'))
+        books[title] = {'size': len(title), 'sha256': title}
+    index = bundle_shards.build_shards(str(export_dir), str(shard_dir), [], 1, books)
+
+    hashed = []
+    monkeypatch.setattr(bundle_shards, 'file_sha256', lambda path: hashed.append(path) or 'new')
+    (export_dir / 'Leviticus.zip').write_bytes(b'Leviticus')
+    books['Leviticus'] = {'size': 9, 'sha256': 'Leviticus'}
+    rebuilt = bundle_shards.build_shards(str(export_dir), str(shard_dir), [], 1, books)
+    assert all(shard in rebuilt['shards'] for shard in index['shards'])
+    assert len(hashed) == len(rebuilt['shards']) - len(index['shards']) > 0
+    assert bundle_shards.ShardIndexCache().get(str(shard_dir)).id == rebuilt['id']
+    assert bundle_shards.ShardIndexCache().get(str(tmp_path / 'missing')) is None
+
+
+def test_export_catalog_rehashes_only_changed_zips(tmp_path):
+    (tmp_path / 'Genesis.zip').write_bytes(b'abc')
+    (tmp_path / 'Exodus.zip').write_bytes(b'de')
+    catalog = export_catalog.ExportCatalog(str(tmp_path)).scan().save()
+    assert catalog.books['Genesis']['sha256'] == hashlib.sha256(b'abc').hexdigest()
+
+    catalog.books['Exodus']['sha256'] = 'unchanged'
+    (tmp_path / 'Genesis.zip').write_bytes(b'abcd')
+    os.remove(tmp_path / 'Exodus.zip')
+    catalog.update(['Genesis'])
+    assert catalog.books['Genesis'] == {'size': 4, 'mtime': os.stat(tmp_path / 'Genesis.zip').st_mtime,
+                                        'sha256': hashlib.sha256(b'abcd').hexdigest()}
+    assert catalog.books['Exodus']['sha256'] == 'unchanged'
+    assert sorted(export_catalog.ExportCatalog(str(tmp_path)).load().titles()) == ['Exodus', 'Genesis']
+    assert export_catalog.CatalogCache().get(str(tmp_path / 'missing')) == {}
+
+    fresh = export_catalog.ExportCatalog(str(tmp_path))
+    assert fresh.entry('Genesis') == catalog.books['Genesis'] and fresh.entry('Missing') is None
+    assert fresh._books is None  # entries for the parent process don't load the catalog
+
+
+def test_export_catalog_scan_reuses_saved_hashes(tmp_path, monkeypatch):
+    (tmp_path / 'Genesis.zip').write_bytes(b'abc')
+    (tmp_path / 'Exodus.zip').write_bytes(b'de')
+    saved = export_catalog.ExportCatalog(str(tmp_path)).scan().save().books
+
+    hashed = []
+    monkeypatch.setattr(export_catalog, 'file_sha256', lambda path: hashed.append(path) or 'new')
+    assert export_catalog.ExportCatalog(str(tmp_path)).scan().books == saved
+    assert hashed == []
+
+
+def test_catalog_cache_rescans_without_saved_catalog(tmp_path):
+    cache = export_catalog.CatalogCache(recheck_interval=0)
+    assert cache.get(str(tmp_path)) == {}
+    (tmp_path / 'Genesis.zip').write_bytes(b'abc')
+    assert list(cache.get(str(tmp_path))) == ['Genesis']
+
+
+def test_exporter_modules_dont_load_metrics():
+    # exporter and pool processes would each register Prometheus metrics, leaving files in PROMETHEUS_MULTIPROC_DIR
+    code = ('import sys, export_common, export_catalog, export_queue, bundle_shards; '
+            'assert "metrics" not in sys.modules and "prometheus_client" not in sys.modules')
+    subprocess.run([sys.executable, '-c', code], check=True, cwd=os.path.dirname(os.path.dirname(__file__)) or '.')
+
+
+def test_build_lease_is_exclusive_until_stale(tmp_path):
+    lock_path = str(tmp_path / 'bundle.lock')
+    holder = build_lease.BuildLease(lock_path, ttl=60)
+    assert holder.acquire()
+    contender = build_lease.BuildLease(lock_path, ttl=60)
+    assert not contender.acquire()
+    assert build_lease.is_leased(lock_path)
+
+    os.utime(lock_path, (1000, 1000))  # holder stopped heartbeating
+    assert contender.acquire() and contender.took_over
+    assert not holder.is_held()
+    holder.release()  # must not remove the contender's lock
+    assert contender.is_held()
+    contender.release()
+    assert not build_lease.is_leased(lock_path)
+
+
+def test_clear_old_bundles_keeps_packages_and_lease_files(tmp_path, monkeypatch):
+    monkeypatch.setattr(export_common, 'SEFARIA_EXPORT_PATH', str(tmp_path))
+    root = tmp_path / '7' / 'bundles'
+    for name in ('PACKAGE', 'adhoc', '.adhoc.1234.tmp'):
+        (root / name).mkdir(parents=True)
+    (root / '.adhoc.lock').write_text('token')
+    (tmp_path / '7' / 'packages.json').write_text('[{"en": "PACKAGE"}]')
+    export_common.clear_old_bundles('7', max_files=0)
+    assert sorted(os.listdir(root)) == ['.adhoc.1234.tmp', '.adhoc.lock', 'PACKAGE']
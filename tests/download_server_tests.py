@@ -0,0 +1,179 @@
+import io
+import json
+import hashlib
+import zipfile
+import pytest
+import DownloadServer
+import bundle_manifest
+
+
+@pytest.fixture()
+def export_path(tmp_path, monkeypatch):
+    monkeypatch.setattr(DownloadServer, 'SEFARIA_EXPORT_PATH', str(tmp_path))
+    path = tmp_path / '7'
+    path.mkdir()
+    for title in ('Genesis', 'Exodus'):
+        (path / f'{title}.zip').write_bytes(title.encode('utf-8') * 100)
+    (path / 'last_updated.json').write_text(json.dumps({'schema_version': '7', 'titles': {
+        'Genesis': '2024-01-02T00:00:00', 'Exodus': '2024-01-02T00:00:00'}}))
+    return path
+
+
+@pytest.fixture()
+def client():
+    return DownloadServer.app.test_client()
+
+
+def test_delta_bundle_compares_time_stamps_with_offsets(export_path, client):
+    response = client.post('/deltaBundle?schema_version=7', json={'wait': 10, 'titles': {
+        'Genesis': '2024-01-01T12:00:00+00:00', 'Exodus': '2024-01-03T00:00:00+02:00'}})
+    assert response.status_code == 200
+    assert response.json['books'] == ['Genesis']
+    assert len(response.json['bundleArray']) == 1
+
+    response = client.post('/deltaBundle?schema_version=7', json={'titles': {}, 'books': ['Exodus'], 'wait': 10})
+    assert response.json['books'] == ['Exodus']
+
+    response = client.post('/deltaBundle?schema_version=7', json={'titles': {
+        'Genesis': '2024-01-03T00:00:00', 'Exodus': '2024-01-03T00:00:00Z'}})
+    assert response.status_code == 200
+    assert response.json == {'books': [], 'bundleArray': [], 'downloadSize': 0, 'parts': []}
+
+
+@pytest.mark.parametrize('body', [
+    {'titles': {'Genesis': 'yesterday'}},
+    {'titles': {'Genesis': 5}},
+    {'titles': {}, 'books': 'Genesis'},
+    {'titles': {}, 'books': [{'title': 'Genesis'}]},
+    {'titles': ['Genesis']},
+])
+def test_delta_bundle_rejects_invalid_input(export_path, client, body):
+    assert client.post('/deltaBundle?schema_version=7', json=body).status_code == 400
+
+
+def test_delta_bundle_without_export(tmp_path, monkeypatch, client):
+    monkeypatch.setattr(DownloadServer, 'SEFARIA_EXPORT_PATH', str(tmp_path))
+    assert client.post('/deltaBundle?schema_version=7', json={'titles': {}}).status_code == 404
+
+
+@pytest.mark.parametrize('route', ['/makeBundle', '/streamBundle'])
+@pytest.mark.parametrize('books', ['Genesis', [{'en': 'Genesis'}], [['Genesis']], ['Genesis', 7]])
+def test_bundle_routes_reject_invalid_books(export_path, client, route, books):
+    assert client.post(f'{route}?schema_version=7', json={'books': books}).status_code == 400
+
+
+def test_bundle_part_etag_follows_rewritten_part(export_path, client):
+    bundle_dir = export_path / 'bundles' / 'abc'
+    bundle_dir.mkdir(parents=True)
+    (bundle_dir / '1.zip').write_bytes(b'abc')
+    bundle_manifest.write_manifest(str(bundle_dir), ['1.zip'])
+    url = '/static/ios-export/7/bundles/abc/1.zip'
+    assert client.get(url).headers['ETag'] == f'"{hashlib.sha256(b"abc").hexdigest()}"'
+
+    (bundle_dir / '1.zip').write_bytes(b'abcd')  # the cached manifest still lists the old part
+    assert client.get(url).headers['ETag'] == f'"{hashlib.sha256(b"abcd").hexdigest()}"'
+
+
+def test_stream_bundle(export_path, client):
+    response = client.post('/streamBundle?schema_version=7', json={'books': ['Genesis', 'Missing', 'Exodus']})
+    assert response.status_code == 200
+    assert response.mimetype == 'application/zip'
+    filename = DownloadServer.get_bundle_filename(['Genesis.zip', 'Exodus.zip'])
+    assert response.headers['Content-Disposition'] == f'attachment; filename={filename}.zip'
+    with zipfile.ZipFile(io.BytesIO(response.data)) as z:
+        assert z.namelist() == ['Genesis.zip', 'Exodus.zip']
+        assert z.read('Exodus.zip') == (export_path / 'Exodus.zip').read_bytes()
+    assert client.post('/streamBundle?schema_version=7', json={}).status_code == 400
+
+
+def test_make_bundle_waits_for_the_build(export_path, client):
+    response = client.post('/makeBundle?schema_version=7', json={'books': ['Genesis', 'Exodus'], 'wait': 10})
+    assert response.status_code == 200
+    zip_dirname = DownloadServer.get_bundle_filename(['Genesis.zip', 'Exodus.zip'])
+    assert response.json['bundleArray'] == [f'static/ios-export/7/bundles/{zip_dirname}/1.zip']
+    part_path = export_path / 'bundles' / zip_dirname / '1.zip'
+    assert response.json['parts'] == [{'url': response.json['bundleArray'][0], 'size': part_path.stat().st_size,
+                                       'sha256': hashlib.sha256(part_path.read_bytes()).hexdigest()}]
+    assert response.json['downloadSize'] == part_path.stat().st_size
+    assert client.post('/makeBundle?schema_version=7', json={'books': ['Genesis', 'Exodus']}).json == response.json
+
+
+def test_make_bundle_without_wait_answers_202(export_path, client):
+    response = client.post('/makeBundle?schema_version=7', json={'books': ['Genesis']})
+    assert response.status_code == 202
+    zip_dirname = DownloadServer.get_bundle_filename(['Genesis.zip'])
+    assert response.json['id'] == zip_dirname
+    assert DownloadServer.build_scheduler.get(f'7/{zip_dirname}').wait(10)
+    status = client.get(f'/bundleStatus?schema_version=7&id={zip_dirname}')
+    assert status.json['status'] == 'done' and status.json['bundleArray']
+
+
+@pytest.mark.parametrize('wait', ['soon', [1], True, float('nan'), float('inf')])
+def test_make_bundle_rejects_invalid_wait(export_path, client, wait):
+    body = json.dumps({'books': ['Genesis'], 'wait': wait})
+    response = client.post('/makeBundle?schema_version=7', data=body, content_type='application/json')
+    assert response.status_code == 400
+    assert client.post('/makeBundle?schema_version=7&wait=nan', json={'books': ['Genesis']}).status_code == 400
+
+
+@pytest.mark.parametrize('filename', ['Genesis.zip', 'last_updated.json'])
+def test_export_file_etags_and_ranges(export_path, client, filename):
+    url = f'/static/ios-export/7/{filename}'
+    content = (export_path / filename).read_bytes()
+    etag = f'"{hashlib.sha256(content).hexdigest()}"'
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.data == content
+    assert response.headers['ETag'] == etag
+    assert response.headers['Accept-Ranges'] == 'bytes'
+
+    response = client.get(url, headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+
+    response = client.get(url, headers={'Range': 'bytes=5-9'})
+    assert response.status_code == 206
+    assert response.data == content[5:10]
+    assert response.headers['Content-Range'] == f'bytes 5-9/{len(content)}'
+
+    response = client.get(url, headers={'Range': 'bytes=5-9', 'If-Range': '"changed"'})
+    assert response.status_code == 200
+    assert response.data == content
+
+
+@pytest.mark.parametrize('filename', ['Missing.zip', '../7/Genesis.zip', '../../etc/passwd'])
+def test_export_file_not_found(export_path, client, filename):
+    assert client.get(f'/static/ios-export/7/{filename}').status_code == 404
+
+
+@pytest.mark.parametrize('bundle_id', ['..', '.', 'abc', '../7', 'A' * 40, '0' * 41])
+def test_bundle_status_rejects_invalid_ids(export_path, client, bundle_id):
+    assert client.get(f'/bundleStatus?schema_version=7&id={bundle_id}').status_code == 400
+
+
+def test_package_data_serves_only_known_packages(export_path, client):
+    (export_path / 'packages.json').write_text(json.dumps([{'en': 'COMPLETE LIBRARY'}]))
+    package_dir = export_path / 'bundles' / 'COMPLETE LIBRARY'
+    package_dir.mkdir(parents=True)
+    (package_dir / '1.zip').write_bytes(b'abc')
+    bundle_manifest.write_manifest(str(package_dir), ['1.zip'])
+    response = client.get('/packageData?schema_version=7&package=COMPLETE LIBRARY')
+    assert response.json == ['static/ios-export/7/bundles/COMPLETE LIBRARY/1.zip']
+
+    for package in ('..', '.', '../bundles/COMPLETE LIBRARY', 'COMPLETE LIBRARY/..'):
+        assert client.get(f'/packageData?schema_version=7&package={package}').json == []
+        assert client.get(f'/packageData?schema_version=7&package={package}&manifest=1').json['parts'] == []
+
+
+def test_update_refuses_long_running_actions(client, monkeypatch):
+    monkeypatch.setenv('PASSWORD', 'secret')
+    monkeypatch.setattr(DownloadServer.os, 'system', lambda command: pytest.fail(f'ran {command}'))
+    assert client.get('/update?password=secret&action=export_watch').status_code == 400
+
+
+@pytest.mark.parametrize('options', [{'parts': True}, {'parts': 'Infinity'}, {'partSize': float('inf')},
+                                     {'parts': float('nan')}, {'partSize': 'many'}, {'parts': [2]}])
+def test_make_bundle_rejects_invalid_part_options(export_path, client, options):
+    body = json.dumps({'books': ['Genesis'], **options})  # json.dumps writes Infinity and NaN like a lenient client
+    response = client.post('/makeBundle?schema_version=7', data=body, content_type='application/json')
+    assert response.status_code == 400
@@ -0,0 +1,18 @@
+import export_queue
+
+
+def test_identical_pending_jobs_are_coalesced(tmp_path):
+    queue = export_queue.ExportQueue(str(tmp_path))
+    first = queue.submit('export_text', 'Genesis')
+    assert queue.submit('export_text', 'Genesis')['id'] == first['id']
+    other = queue.submit('export_text', 'Exodus')
+    assert other['id'] != first['id']
+    assert [job['index'] for job in queue.pending()] == ['Genesis', 'Exodus']
+
+    assert queue.claim(queue.pending()[0]) and not queue.claim({'id': first['id']})
+    queue.set_status(first['id'], export_queue.DONE, finished=1)
+    assert queue.get_status(first['id'])['status'] == export_queue.DONE
+    assert queue.submit('export_text', 'Genesis')['id'] != first['id']  # no longer pending, so it runs again
+    queue.prune()
+    assert queue.get_status(first['id']) is None
+    assert queue.get_status('../x') is None
@@ -1,3 +1,6 @@
+import zipfile
+from types import SimpleNamespace
+from datetime import datetime
 import pytest
 import JsonExporterForIOS as jefi
 from sefaria.model.text import library, Ref
@@ -70,3 +73,39 @@ def test_remove_empty_versions():
 def test_export_text_json(title):
     index = library.get_index(title)
     exported = jefi.export_text_json(index)
+
+
+def test_partial_export_replaces_top_section_files(tmp_path):
+    zip_path = str(tmp_path / 'Rashi on Genesis.zip')
+    with jefi.TextArchive(zip_path) as archive:
+        for tref in ('Rashi on Genesis 1', 'Rashi on Genesis 10'):
+            archive.write_doc({'old': True}, f'{tref}.metadata.json')
+            archive.write_doc({'old': True}, jefi.make_file_name('Vilna', 'he', tref))
+        archive.write_doc({'old': True}, 'Rashi on Genesis_index.json')
+    with jefi.TextArchive(zip_path) as archive:
+        archive.copy_from(zip_path, skip=lambda name: jefi.get_file_ref(name) == 'Rashi on Genesis 1')
+    with zipfile.ZipFile(zip_path) as z:
+        assert sorted(z.namelist()) == sorted([
+            'Rashi on Genesis 10.metadata.json', jefi.make_file_name('Vilna', 'he', 'Rashi on Genesis 10'),
+            'Rashi on Genesis_index.json',
+        ])
+
+
+def test_find_updated_books():
+    last_updated = {'Genesis': datetime(2024, 1, 2), 'Genesis Rabbah': datetime(2024, 1, 1),
+                    'Pesach Haggadah': datetime(2024, 1, 1), 'Exodus': datetime(2024, 1, 5)}
+    history = [
+        SimpleNamespace(date=datetime(2024, 1, 3), ref='Genesis Rabbah 3:4'),
+        SimpleNamespace(date=datetime(2024, 1, 1), ref='Genesis 1:1'),  # before Genesis was last exported
+        SimpleNamespace(date=datetime(2024, 1, 3), old=None, new={'refs': ['Pesach Haggadah, Kadesh 2', 'Exodus 12:1']}),
+    ]
+    assert set(jefi.find_updated_books(history, last_updated)) == {'Genesis Rabbah', 'Pesach Haggadah'}
+    history.append(SimpleNamespace(date=datetime(2024, 1, 3), title='Genesis'))
+    assert set(jefi.find_updated_books(history, last_updated)) == {'Genesis Rabbah', 'Pesach Haggadah', 'Genesis'}
+
+
+def test_history_watermark(tmp_path):
+    watermark = jefi.HistoryWatermark(str(tmp_path / 'watermark.json'))
+    assert watermark.load() is None
+    watermark.save(datetime(2024, 1, 2, 3, 4, 5, 6000))
+    assert watermark.load() == datetime(2024, 1, 2, 3, 4, 5, 6000)
@@ -0,0 +1,36 @@
+import pytest
+import json_encoder
+
+DOCS = [
+    {'ref': 'Genesis 1', 'text': ['בְּרֵאשִׁית בָּרָא', 'In the beginning\n"God"\t\\   \x00 \x7f'], 'links': [[], [{}]]},
+    {'sections': {'Rashi on Genesis 1:1': {'versions': [{'priority': 1.5, 'order': [1, 2, 3], 'enComplete': True,
+                                                         'notes': None}]}}},
+    [0.1, -0.0, 1e-05, 1e+16, 2.5e-300, 123456789.123, 0.0001, 2 ** 63, 2 ** 70, -2 ** 65],
+    {1: 'int key', 2.5: 'float key', None: 'null key'},
+    {True: 'bool key', False: 'bool key'},
+    {'hash': '9e3669d1 0.00001', 'empty': {}, 'nested': [[[[]]]]},
+    [], {}, 'text', 12, None,
+    {'scores': [float('nan'), float('inf'), -float('inf')], 'notes': None},
+]
+
+
+@pytest.mark.skipif(json_encoder.orjson is None, reason='orjson is not installed')
+@pytest.mark.parametrize('minify', [False, True])
+def test_orjson_output_is_identical_to_json(minify):
+    reference = json_encoder.get_encoder(minify, 'json')
+    verified = json_encoder.get_encoder(minify, 'orjson', verify=True)
+    for doc in DOCS:
+        assert json_encoder.OrjsonEncoder(minify).encode(doc) == reference.encode(doc)
+        verified.encode(doc)
+    assert verified.mismatches == 0
+
+
+def test_verifying_encoder_returns_json_output_on_mismatch():
+    class Broken(json_encoder.StdlibEncoder):
+        name = 'broken'
+
+        def encode(self, doc):
+            return b'{}'
+    verified = json_encoder.VerifyingEncoder(Broken(False))
+    assert verified.encode({'a': 1}) == b'{\n    "a": 1\n}'
+    assert verified.mismatches == 1